@@ -8,11 +8,12 @@ Original file is located at
 """
 
 # STEP 1: Install Dependencies
-!pip install -q fastapi uvicorn nest_asyncio transformers accelerate bitsandbytes pyngrok pydantic google-colab
+!pip install -q fastapi uvicorn nest_asyncio transformers accelerate bitsandbytes sentence-transformers pyngrok pydantic google-colab
 
 # STEP 2: Import Libraries
 import torch
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import nest_asyncio
@@ -20,6 +21,15 @@ import uvicorn
 from pyngrok import ngrok, conf
 import threading
 import getpass
+import os
+import json
+import re
+import time
+import random
+from contextlib import aclosing
+from collections import OrderedDict
+from sentence_transformers import SentenceTransformer
+from starlette.concurrency import run_in_threadpool
 
 # Enable async support for Colab
 nest_asyncio.apply()
@@ -52,58 +62,233 @@ app = FastAPI(
     version="1.0"
 )
 
-# STEP 5: Comedy Generator Logic
+# STEP 5: Continuous batching generation scheduler
+from text_generation import ContinuousBatchingScheduler, PrefixCache, SpeculativeDecoder  # NLP/text_generation.py
+
+# STEP 6: Comedy Generator Logic
+# mode -> (fixed instruction prefix, per-request suffix). The prefix's key/values are cached and reused.
+PROMPT_TEMPLATES = {
+    "pickup": (
+        "You're smooth, clever, and charming. Drop an irresistibly funny and clever pick-up line "
+        "about or related to:",
+        " {text}\nPick-up Line:"
+    ),
+    "comedy": (
+        "You're a hilarious stand-up comedian performing on stage. "
+        "Make the audience laugh out loud with a joke or short routine. "
+        "Topic:",
+        " {text}\nComedian:"
+    ),
+}
+
+def prompt_prefix(mode: str = "comedy"):
+    return PROMPT_TEMPLATES.get(mode, PROMPT_TEMPLATES["comedy"])[0]  # Default to stand-up comedy
+
+def build_prompt(text: str, mode: str = "comedy"):
+    prefix, suffix = PROMPT_TEMPLATES.get(mode, PROMPT_TEMPLATES["comedy"])
+    return prefix + suffix.format(text=text.strip())
+
+COMEDY_MAX_BATCH_SIZE = 8
+COMEDY_PREFIX_CACHE_SIZE = 8
+comedy_scheduler = ContinuousBatchingScheduler(
+    mistral_model, tokenizer, max_batch_size=COMEDY_MAX_BATCH_SIZE,
+    prefix_cache=PrefixCache(mistral_model, tokenizer, max_entries=COMEDY_PREFIX_CACHE_SIZE)
+)
+# Precompute the template prefixes once at startup
+for template_prefix, _ in PROMPT_TEMPLATES.values():
+    comedy_scheduler.prefix_cache.get(template_prefix)
+
+# STEP 6a: Optional speculative decoding with a small draft model
+# Set COMEDY_DRAFT_MODEL to a small causal LM that shares the main model's tokenizer to enable it.
+# The draft proposes SPECULATIVE_NUM_TOKENS tokens and the main model verifies them in one forward pass
+# (see SpeculativeDecoder). Assisted generation runs one request at a time, so these requests bypass the
+# batching scheduler and queue for SPECULATIVE_WORKERS threads: it lowers latency at low load, while the
+# scheduler gives more throughput under load. Benchmark a pair with `python text_generation.py --model ... --draft ...`.
+DRAFT_MODEL_NAME = os.environ.get("COMEDY_DRAFT_MODEL")
+SPECULATIVE_NUM_TOKENS = int(os.environ.get("COMEDY_SPECULATIVE_TOKENS", 5))
+SPECULATIVE_WORKERS = int(os.environ.get("COMEDY_SPECULATIVE_WORKERS", 1))
+speculative_decoder = None
+if DRAFT_MODEL_NAME:
+    print(f"🔧 Loading draft model {DRAFT_MODEL_NAME} for speculative decoding...")
+    draft_model = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL_NAME, device_map="auto", torch_dtype=torch.float16)
+    draft_model.generation_config.num_assistant_tokens = SPECULATIVE_NUM_TOKENS
+    # Keep a fixed draft length so the distribution check and benchmark are reproducible
+    draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+    speculative_decoder = SpeculativeDecoder(mistral_model, tokenizer, draft_model, max_workers=SPECULATIVE_WORKERS)
+
 def generate_comedy(text: str, max_length: int = 100, temperature: float = 0.9, mode: str = "comedy"):
-    if mode == "pickup":
-        prompt = (
-            "You're smooth, clever, and charming. Drop an irresistibly funny and clever pick-up line "
-            f"about or related to: {text.strip()}\nPick-up Line:"
-        )
-    else:  # Default to stand-up comedy
-        prompt = (
-            "You're a hilarious stand-up comedian performing on stage. "
-            "Make the audience laugh out loud with a joke or short routine. "
-            f"Topic: {text.strip()}\nComedian:"
-        )
-
-    inputs = tokenizer(prompt, return_tensors="pt").to(mistral_model.device)
-    outputs = mistral_model.generate(
-        **inputs,
-        max_new_tokens=max_length,
-        temperature=temperature,
-        do_sample=True,
-        top_k=50,
-        top_p=0.95,
-        eos_token_id=tokenizer.eos_token_id
-    )
-    return tokenizer.decode(outputs[0], skip_special_tokens=True).replace(prompt, "").strip()
-
-# STEP 6: Define Request Body
+    if speculative_decoder is not None:
+        return speculative_decoder.submit(build_prompt(text, mode), max_new_tokens=max_length, temperature=temperature).result()
+    # Only generated tokens are decoded, so the prompt never needs to be stripped from the output
+    return comedy_scheduler.submit(build_prompt(text, mode), max_new_tokens=max_length, temperature=temperature,
+                                   prefix=prompt_prefix(mode)).result()
+
+# STEP 6b: Semantic response cache (opt-in per request)
+class SemanticResponseCache:
+    """Reuses generations for near-duplicate topics ("cats", "my cat", "cats!").
+
+    Entries are keyed by (mode, generation settings, normalized topic embedding). A topic whose cosine
+    similarity to a cached topic with the same mode and settings (e.g. max length and temperature)
+    is at least `threshold` hits that entry. Each entry keeps a pool of
+    up to `variants_per_entry` generations: until the pool is full a hit still generates (and adds
+    the result), so repeated topics keep getting different outputs; once full a random variant is
+    returned. Entries expire after `ttl_seconds` and the least recently used are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, embedder, threshold=0.9, variants_per_entry=4, max_entries=1024, ttl_seconds=24 * 3600):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.variants_per_entry = variants_per_entry
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # entry id -> {"mode", "settings", "embedding", "variants", "created_at"}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_topic(text):
+        return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+    def _embed(self, topic):
+        return self.embedder.encode(self.normalize_topic(topic), normalize_embeddings=True, convert_to_tensor=True).float().cpu()
+
+    def _match(self, mode, settings, embedding, now):
+        # Caller holds self._lock. Returns the id of the most similar live entry above the threshold.
+        for entry_id in [i for i, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]:
+            del self._entries[entry_id]
+        candidates = [(i, e["embedding"]) for i, e in self._entries.items()
+                      if e["mode"] == mode and e["settings"] == settings]
+        if not candidates:
+            return None
+        similarities = torch.stack([emb for _, emb in candidates]) @ embedding
+        best = int(similarities.argmax())
+        return candidates[best][0] if float(similarities[best]) >= self.threshold else None
+
+    def lookup(self, mode, topic, settings=()):
+        """Returns (cached text or None, embedding). Pass the embedding back to `add` on a miss."""
+        embedding = self._embed(topic)
+        with self._lock:
+            entry_id = self._match(mode, settings, embedding, time.time())
+            if entry_id is None:
+                return None, embedding
+            self._entries.move_to_end(entry_id)
+            variants = self._entries[entry_id]["variants"]
+            if len(variants) < self.variants_per_entry:
+                return None, embedding
+            return random.choice(variants), embedding
+
+    def add(self, mode, embedding, text, settings=()):
+        if not text:
+            return
+        with self._lock:
+            now = time.time()
+            entry_id = self._match(mode, settings, embedding, now)
+            if entry_id is None:
+                entry_id = self._next_id
+                self._next_id += 1
+                self._entries[entry_id] = {"mode": mode, "settings": settings, "embedding": embedding,
+                                           "variants": [], "created_at": now}
+            self._entries.move_to_end(entry_id)
+            variants = self._entries[entry_id]["variants"]
+            if len(variants) < self.variants_per_entry and text not in variants:
+                variants.append(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+COMEDY_CACHE_THRESHOLD = 0.9  # Cosine similarity between normalized topics
+COMEDY_CACHE_VARIANTS = 4
+COMEDY_CACHE_MAX_ENTRIES = 1024
+COMEDY_CACHE_TTL_SECONDS = 24 * 3600
+# Small embedder kept on CPU so it doesn't compete with the 7B model for GPU memory
+topic_embedder = SentenceTransformer("BAAI/bge-small-en", device="cpu")
+comedy_cache = SemanticResponseCache(
+    topic_embedder, threshold=COMEDY_CACHE_THRESHOLD, variants_per_entry=COMEDY_CACHE_VARIANTS,
+    max_entries=COMEDY_CACHE_MAX_ENTRIES, ttl_seconds=COMEDY_CACHE_TTL_SECONDS
+)
+
+# STEP 7: Define Request Body
 class ComedyRequest(BaseModel):
     text: str
     max_length: int = 100
     temperature: float = 0.9
     mode: str = "comedy"  # "comedy" or "pickup"
+    stream: bool = False  # Send tokens as Server-Sent Events while they are generated
+    use_cache: bool = False  # Allow an earlier generation for a near-identical topic to be returned
 
-# STEP 7: API Endpoints
+def cache_settings(request: ComedyRequest):
+    # Generations are only reused for requests asking for the same length and temperature
+    return (request.max_length, request.temperature)
+
+# STEP 8: API Endpoints
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Comedy & Pickup Line Generator API. Use /docs to explore endpoints."}
 
 @app.post("/generate_comedy/")
-async def text_to_comedy(request: ComedyRequest):
+async def text_to_comedy(request: ComedyRequest, http_request: Request):
+    if request.stream:
+        return StreamingResponse(stream_comedy_events(request, http_request), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
     try:
-        result = generate_comedy(
-            text=request.text,
-            max_length=request.max_length,
-            temperature=request.temperature,
-            mode=request.mode
-        )
+        if request.use_cache:
+            cached, embedding = await run_in_threadpool(comedy_cache.lookup, request.mode, request.text,
+                                                        cache_settings(request))
+            if cached is not None:
+                return {"result": cached, "cached": True}
+        if speculative_decoder is not None:
+            result = await speculative_decoder.generate(build_prompt(request.text, request.mode),
+                                                        request.max_length, request.temperature)
+        else:
+            # Queued on the shared scheduler; awaiting keeps the event loop free while the batch runs
+            result = await comedy_scheduler.generate(
+                build_prompt(request.text, request.mode),
+                max_new_tokens=request.max_length,
+                temperature=request.temperature,
+                prefix=prompt_prefix(request.mode)
+            )
+        if request.use_cache:
+            comedy_cache.add(request.mode, embedding, result, cache_settings(request))
         return {"result": result}
     except Exception as e:
         return {"error": str(e)}
 
-# STEP 8: Start Server with Ngrok
+async def stream_comedy_events(request: ComedyRequest, http_request: Request):
+    """SSE stream: one "token" event per text piece, then a "done" event with the full result.
+
+    Generation stops as soon as the client disconnects.
+    """
+    result = ""
+    try:
+        if request.use_cache:
+            cached, embedding = await run_in_threadpool(comedy_cache.lookup, request.mode, request.text,
+                                                        cache_settings(request))
+            if cached is not None:
+                yield f"event: token\ndata: {json.dumps({'token': cached})}\n\n"
+                yield f"event: done\ndata: {json.dumps({'result': cached, 'cached': True})}\n\n"
+                return
+        if speculative_decoder is not None:
+            pieces = speculative_decoder.stream(build_prompt(request.text, request.mode), request.max_length, request.temperature)
+        else:
+            pieces = comedy_scheduler.stream(
+                build_prompt(request.text, request.mode),
+                max_new_tokens=request.max_length,
+                temperature=request.temperature,
+                prefix=prompt_prefix(request.mode)
+            )
+        # aclosing() stops the generation right away when we return early, instead of at garbage collection
+        async with aclosing(pieces):
+            async for piece in pieces:
+                if await http_request.is_disconnected():
+                    return
+                result += piece
+                yield f"event: token\ndata: {json.dumps({'token': piece})}\n\n"
+        if request.use_cache:
+            comedy_cache.add(request.mode, embedding, result.strip(), cache_settings(request))
+        yield f"event: done\ndata: {json.dumps({'result': result.strip()})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+# STEP 9: Start Server with Ngrok
 def start_ngrok():
     NGROK_AUTH_TOKEN = getpass.getpass("🔐 Enter your Ngrok Authtoken: ")
     conf.get_default().auth_token = NGROK_AUTH_TOKEN
@@ -17,7 +17,9 @@ import pdfplumber
 import pytesseract
 from PIL import Image
 import re
-import tempfile
+import io
+import threading
+from document_cache import DocumentCache  # NLP/document_cache.py, shared with the other resume app
 from fastapi import FastAPI, UploadFile, Form
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -27,7 +29,6 @@ from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import nest_asyncio
 import uvicorn
 from pyngrok import ngrok, conf
-import threading
 import getpass
 from google.colab.output import eval_js
 
@@ -36,7 +37,8 @@ nest_asyncio.apply()
 
 # STEP 4: Load Resume Analyzer Model
 print("🔧 Loading Resume Analyzer model...")
-embedder = SentenceTransformer("BAAI/bge-small-en", device="cuda" if torch.cuda.is_available() else "cpu")
+EMBEDDING_MODEL = "BAAI/bge-small-en"
+embedder = SentenceTransformer(EMBEDDING_MODEL, device="cuda" if torch.cuda.is_available() else "cpu")
 print("✅ Resume model loaded!")
 
 # STEP 5: Load Comedy Generator Model
@@ -77,14 +79,31 @@ app.add_middleware(
 def clean_text(text):
     return ' '.join(text.strip().split())
 
-def extract_text_from_pdf(path):
-    with pdfplumber.open(path) as pdf:
+def extract_text_from_pdf(data):
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
         return clean_text("\n".join(page.extract_text() or "" for page in pdf.pages))
 
-def extract_text_from_image(path):
-    image = Image.open(path)
+def extract_text_from_image(data):
+    image = Image.open(io.BytesIO(data))
     return clean_text(pytesseract.image_to_string(image))
 
+# --- Parsed-document cache keyed by file content hash ---
+document_cache = DocumentCache(EMBEDDING_MODEL)
+
+def extract_resume_text(filename, data, key):
+    """Extracts resume text by file extension, reusing the cached text for previously seen content; None if unsupported."""
+    if filename.lower().endswith(".pdf"):
+        extract = extract_text_from_pdf
+    elif filename.lower().endswith((".png", ".jpg", ".jpeg")):
+        extract = extract_text_from_image
+    else:
+        return None
+    text = document_cache.get_text(key)
+    if text is None:
+        text = extract(data)
+        document_cache.put_text(key, text)
+    return text
+
 def extract_name(text):
     for line in text.split("\n")[:5]:
         if re.match(r"^[A-Z][a-z]+ [A-Z][a-z]+", line.strip()):
@@ -99,8 +118,14 @@ def extract_job_info(jd):
         company.group(1).strip() if company else "your company"
     )
 
-def compute_ats_score(resume, jd):
-    emb_resume = embedder.encode(clean_text(resume), convert_to_tensor=True)
+def compute_ats_score(resume, jd, resume_key=None):
+    cached = document_cache.get_embedding(resume_key) if resume_key else None
+    if cached is None:
+        emb_resume = embedder.encode(clean_text(resume), convert_to_tensor=True)
+        if resume_key:
+            document_cache.put_embedding(resume_key, emb_resume.cpu().numpy())
+    else:
+        emb_resume = torch.from_numpy(cached).to(embedder.device)
     emb_jd = embedder.encode(clean_text(jd), convert_to_tensor=True)
     return round(util.pytorch_cos_sim(emb_resume, emb_jd).item() * 100, 2)
 
@@ -144,20 +169,16 @@ class ComedyRequest(BaseModel):
 # --- API Endpoints ---
 @app.post("/analyze/")
 async def analyze(resume_file: UploadFile, job_desc: str = Form(...), user_name: str = Form("")):
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await resume_file.read())
-        tmp_path = tmp.name
-
-    if resume_file.filename.endswith(".pdf"):
-        resume_text = extract_text_from_pdf(tmp_path)
-    elif resume_file.filename.lower().endswith((".png", ".jpg", ".jpeg")):
-        resume_text = extract_text_from_image(tmp_path)
-    else:
+    data = await resume_file.read()
+    resume_key = document_cache.key_for(data)
+
+    resume_text = extract_resume_text(resume_file.filename, data, resume_key)
+    if resume_text is None:
         return JSONResponse(content={"error": "Unsupported file type"}, status_code=400)
 
     name = user_name if user_name.strip() else extract_name(resume_text)
     job_title, company = extract_job_info(job_desc)
-    ats_score = compute_ats_score(resume_text, job_desc)
+    ats_score = compute_ats_score(resume_text, job_desc, resume_key)
     letter = generate_cover_letter(name, job_title, company)
 
     return {
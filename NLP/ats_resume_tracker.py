@@ -18,7 +18,7 @@ sentence-transformers keybert nltk pillow
 !pip install fastapi uvicorn pyngrok python-multipart pdfplumber pytesseract pillow sentence-transformers
 
 # STEP 1: Install dependencies
-!pip install -q sentence-transformers pdfplumber pytesseract pillow pyngrok fastapi uvicorn nest_asyncio
+!pip install -q sentence-transformers pdfplumber pytesseract pillow pyngrok fastapi uvicorn nest_asyncio hnswlib
 
 # STEP 2: Imports
 import torch
@@ -26,10 +26,21 @@ import pdfplumber
 import pytesseract
 from PIL import Image
 import re
-import tempfile
 import time
 import threading
-from fastapi import FastAPI, UploadFile, Form
+import queue
+import io
+import os
+import json
+import sqlite3
+import zipfile
+import tempfile
+import numpy as np
+from document_cache import DocumentCache  # NLP/document_cache.py, shared with the other resume app
+from typing import List
+from concurrent.futures import Future, ProcessPoolExecutor
+from fastapi import FastAPI, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer, util
@@ -43,23 +54,296 @@ nest_asyncio.apply()
 
 # STEP 4: Load embedding model
 print("🔧 Loading BGE model...")
-embedder = SentenceTransformer("BAAI/bge-small-en", device="cuda" if torch.cuda.is_available() else "cpu")
+EMBEDDING_MODEL = "BAAI/bge-small-en"
+embedder = SentenceTransformer(EMBEDDING_MODEL, device="cuda" if torch.cuda.is_available() else "cpu")
 print("✅ Model loaded!")
 
+# STEP 4b: Request-coalescing embedding service
+class BatchingEmbedder:
+    """Collects concurrent encode calls for up to `max_wait_ms` or `max_batch_size` texts and runs one batched encode."""
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def encode(self, texts):
+        """Blocks until the given texts are embedded; returns a tensor with one row per text."""
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return torch.stack([future.result() for future in futures])
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = self.model.encode([text for text, _ in batch], batch_size=len(batch), convert_to_tensor=True)
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+batching_embedder = BatchingEmbedder(embedder)
+
+# STEP 4c: Persistent resume corpus (memory-mapped embeddings + HNSW index)
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None  # Falls back to exact search over the memory-mapped matrix
+
+class ResumeStore:
+    """Stores each resume's text once and its normalized embedding as one row of a memory-mapped float32 matrix.
+
+    Rows are indexed incrementally in an HNSW inner-product index, so a JD query is an
+    approximate nearest-neighbour lookup instead of re-encoding the corpus. The index file is
+    written at most every `save_interval` seconds and on shutdown (`save`); rows added after the
+    last save are re-indexed from the vectors file on startup.
+    """
+
+    def __init__(self, directory="resume_store", dim=None, initial_capacity=1024, ef_construction=200, m=16, ef_search=64,
+                 save_interval=60.0):
+        os.makedirs(directory, exist_ok=True)
+        self.dim = dim or embedder.get_sentence_embedding_dimension()
+        self._lock = threading.Lock()
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._index_path = os.path.join(directory, "hnsw.bin")
+        self._meta_path = os.path.join(directory, "store.json")
+        self._ef_construction, self._m, self._ef_search = ef_construction, m, ef_search
+        self._save_interval = save_interval
+        self._last_saved = time.monotonic()
+        self._unsaved = False
+
+        self._db = sqlite3.connect(os.path.join(directory, "resumes.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS resumes (id INTEGER PRIMARY KEY, filename TEXT, name TEXT, text TEXT, created_at REAL)"
+        )
+        self._db.commit()
+        self.count = self._db.execute("SELECT COUNT(*) FROM resumes").fetchone()[0]
+
+        capacity = initial_capacity
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                capacity = json.load(f)["capacity"]
+        self._open_vectors(max(capacity, self.count))
+        self._open_index()
+
+    def _open_vectors(self, capacity):
+        self.capacity = capacity
+        mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+        if mode == "r+" and os.path.getsize(self._vectors_path) < capacity * self.dim * 4:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(capacity * self.dim * 4)
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        with open(self._meta_path, "w") as f:
+            json.dump({"capacity": capacity, "dim": self.dim}, f)
+
+    def _open_index(self):
+        self.index = None
+        if hnswlib is None:
+            return
+        self.index = hnswlib.Index(space="ip", dim=self.dim)
+        if os.path.exists(self._index_path):
+            self.index.load_index(self._index_path, max_elements=self.capacity)
+        else:
+            self.index.init_index(max_elements=self.capacity, ef_construction=self._ef_construction, M=self._m)
+        # Index rows that were stored but not yet saved into the index file (e.g. after a crash).
+        indexed = self.index.get_current_count()
+        if indexed < self.count:
+            self.index.add_items(np.asarray(self.vectors[indexed:self.count]), np.arange(indexed, self.count))
+            self._unsaved = True
+        self.index.set_ef(self._ef_search)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.vectors.flush()
+        del self.vectors
+        self._open_vectors(capacity)
+        if self.index is not None:
+            self.index.resize_index(capacity)
+
+    def add(self, filenames, texts):
+        """Embeds and stores new resumes; returns their IDs."""
+        embeddings = embedder.encode([clean_text(t) for t in texts], batch_size=64, normalize_embeddings=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            start = self.count
+            ids = np.arange(start, start + len(texts))
+            if start + len(texts) > self.capacity:
+                self._grow(start + len(texts))
+            self.vectors[start:start + len(texts)] = embeddings
+            self.vectors.flush()
+            self._db.executemany(
+                "INSERT INTO resumes (id, filename, name, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(int(i), filename, extract_name(text), text, time.time()) for i, filename, text in zip(ids, filenames, texts)],
+            )
+            self._db.commit()
+            if self.index is not None:
+                self.index.add_items(embeddings, ids)
+                self._unsaved = True
+            self.count += len(texts)
+            if time.monotonic() - self._last_saved >= self._save_interval:
+                self._save_index()
+        return ids.tolist()
+
+    def _save_index(self):
+        if self.index is not None and self._unsaved:
+            self.index.save_index(self._index_path)
+            self._unsaved = False
+        self._last_saved = time.monotonic()
+
+    def save(self):
+        """Writes the HNSW index to disk if rows were added since the last save."""
+        with self._lock:
+            self._save_index()
+
+    def search(self, query_text, top_k=10):
+        """Returns the top-k stored resumes for a query as dicts with id, filename, name and score (%)."""
+        query = embedder.encode(clean_text(query_text), normalize_embeddings=True).astype(np.float32)
+        with self._lock:
+            if self.count == 0:
+                return []
+            k = min(top_k, self.count)
+            if self.index is not None:
+                labels, distances = self.index.knn_query(query, k=k)
+                ids, scores = labels[0], 1.0 - distances[0]  # hnswlib "ip" distance is 1 - dot product
+            else:
+                similarities = np.asarray(self.vectors[:self.count]) @ query
+                ids = np.argsort(-similarities)[:k]
+                scores = similarities[ids]
+            rows = {
+                row[0]: row[1:]
+                for row in self._db.execute(
+                    f"SELECT id, filename, name FROM resumes WHERE id IN ({','.join('?' * len(ids))})", [int(i) for i in ids]
+                )
+            }
+        return [
+            {"id": int(i), "filename": rows[int(i)][0], "name": rows[int(i)][1], "score": round(float(score) * 100, 2)}
+            for i, score in zip(ids, scores)
+        ]
+
+# STEP 4d: Parsed-document cache keyed by file content hash
+document_cache = DocumentCache(EMBEDDING_MODEL)
+
 # STEP 5: FastAPI app
 app = FastAPI(title="Resume Analyzer", description="ATS Match + Cover Letter Generator", version="1.0")
+resume_store = ResumeStore()
+
+@app.on_event("shutdown")
+def save_resume_store():
+    resume_store.save()
 
 # Utility functions
 def clean_text(text):
     return ' '.join(text.strip().split())
 
-def extract_text_from_pdf(path):
-    with pdfplumber.open(path) as pdf:
-        return clean_text("\n".join(page.extract_text() or "" for page in pdf.pages))
-
-def extract_text_from_image(path):
-    image = Image.open(path)
-    return clean_text(pytesseract.image_to_string(image))
+# Document ingestion: pages fan out across a process pool, and only pages without a text layer are OCR'd.
+OCR_MAX_DIMENSION = 2000  # Longest side, in pixels, images are downscaled to before Tesseract
+OCR_RESOLUTION = 300      # DPI used to rasterize image-only PDF pages
+PAGE_POOL_WORKERS = os.cpu_count()
+page_pool = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool():
+    """Returns the page-extraction process pool, starting it on first use."""
+    global page_pool
+    with _page_pool_lock:
+        if page_pool is None:
+            page_pool = ProcessPoolExecutor(max_workers=PAGE_POOL_WORKERS)
+        return page_pool
+
+@app.on_event("startup")
+def start_page_pool():
+    get_page_pool()
+
+@app.on_event("shutdown")
+def stop_page_pool():
+    global page_pool
+    with _page_pool_lock:
+        if page_pool is not None:
+            page_pool.shutdown()
+            page_pool = None
+
+def _read_source(source):
+    # Accepts a path, raw bytes or a binary file object.
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+def preprocess_for_ocr(image):
+    """Converts to grayscale, downscales to OCR_MAX_DIMENSION and binarizes with Otsu's threshold."""
+    image = image.convert("L")
+    if max(image.size) > OCR_MAX_DIMENSION:
+        image.thumbnail((OCR_MAX_DIMENSION, OCR_MAX_DIMENSION), Image.LANCZOS)
+    pixels = np.asarray(image)
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total_weight, total_mean = weights[-1], means[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between_class_variance = (total_mean * weights - means * total_weight) ** 2 / (weights * (total_weight - weights))
+    threshold = int(np.argmax(np.nan_to_num(between_class_variance, nan=-1.0)))  # Uniform images have no valid split
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8))
+
+def ocr_image(image):
+    return pytesseract.image_to_string(preprocess_for_ocr(image))
+
+def _extract_page_text(page):
+    """Returns a page's text layer, falling back to OCR for image-only pages."""
+    text = page.extract_text() or ""
+    if text.strip():
+        return text
+    return ocr_image(page.to_image(resolution=OCR_RESOLUTION).original)
+
+def _extract_pdf_pages(pdf_path, first_page, last_page):
+    """Returns the text of pages [first_page, last_page) of the PDF at `pdf_path`. Runs in a worker process."""
+    with pdfplumber.open(pdf_path) as pdf:
+        return [_extract_page_text(pdf.pages[i]) for i in range(first_page, last_page)]
+
+def extract_text_from_pdf(source):
+    if isinstance(source, (str, os.PathLike)):
+        return _extract_text_from_pdf_path(source)
+    # Workers read the PDF from a temporary file instead of each being sent a copy of its bytes.
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(_read_source(source))
+        f.flush()
+        return _extract_text_from_pdf_path(f.name)
+
+def _extract_text_from_pdf_path(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        if page_count <= 1:
+            return clean_text("\n".join(_extract_page_text(page) for page in pdf.pages))
+    # One contiguous page range per worker, so each process opens the PDF once.
+    chunk = -(-page_count // PAGE_POOL_WORKERS)
+    starts = range(0, page_count, chunk)
+    ends = [min(start + chunk, page_count) for start in starts]
+    ranges = get_page_pool().map(_extract_pdf_pages, [pdf_path] * len(starts), starts, ends)
+    return clean_text("\n".join(text for pages in ranges for text in pages))
+
+def extract_text_from_image(source):
+    image = Image.open(io.BytesIO(_read_source(source)))
+    return clean_text(ocr_image(image))
 
 def extract_name(text):
     for line in text.split("\n")[:5]:
@@ -75,11 +359,97 @@ def extract_job_info(jd):
         company.group(1).strip() if company else "your company"
     )
 
-def compute_ats_score(resume, jd):
-    emb_resume = embedder.encode(clean_text(resume), convert_to_tensor=True)
-    emb_jd = embedder.encode(clean_text(jd), convert_to_tensor=True)
+def compute_ats_score(resume, jd, resume_key=None):
+    """Scores a resume against a JD. With `resume_key`, the resume embedding is read from / written to the document cache."""
+    cached = document_cache.get_embedding(resume_key) if resume_key else None
+    if cached is None:
+        emb_resume, emb_jd = batching_embedder.encode([clean_text(resume), clean_text(jd)])
+        if resume_key:
+            document_cache.put_embedding(resume_key, emb_resume.cpu().numpy())
+    else:
+        emb_jd = batching_embedder.encode([clean_text(jd)])[0]
+        emb_resume = torch.from_numpy(cached).to(emb_jd.device)
     return round(util.pytorch_cos_sim(emb_resume, emb_jd).item() * 100, 2)
 
+def extract_resume_text(filename, data, key=None):
+    """Extracts text from resume bytes based on the file extension; returns None for unsupported types.
+
+    Results are cached by content hash, so re-uploads of the same file skip parsing and OCR.
+    """
+    if filename.lower().endswith(".pdf"):
+        extract = extract_text_from_pdf
+    elif filename.lower().endswith((".png", ".jpg", ".jpeg")):
+        extract = extract_text_from_image
+    else:
+        return None
+    key = key or document_cache.key_for(data)
+    text = document_cache.get_text(key)
+    if text is None:
+        text = extract(data)
+        document_cache.put_text(key, text)
+    return text
+
+def iter_resume_uploads(filename, data):
+    """Yields (filename, bytes) for an upload, expanding .zip archives into their members.
+
+    Unreadable archives and members are yielded with bytes=None so the caller can skip them.
+    """
+    if filename.lower().endswith(".zip"):
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            yield filename, None
+            return
+        with archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                try:
+                    member_data = archive.read(member)
+                except Exception as e:  # bad CRC, unsupported compression, encrypted member...
+                    print(f"Skipping {member.filename} in {filename}: {e}")
+                    member_data = None
+                yield member.filename, member_data
+    else:
+        yield filename, data
+
+def extract_uploads(uploads):
+    """Extracts text from (filename, bytes) uploads; returns (filenames, texts, skipped filenames).
+
+    A file that can't be read or parsed is reported under "skipped" instead of failing the batch.
+    """
+    names, texts, skipped = [], [], []
+    for upload_name, data in uploads:
+        for filename, file_bytes in iter_resume_uploads(upload_name, data):
+            text = None
+            if file_bytes is not None:
+                try:
+                    text = extract_resume_text(filename, file_bytes)
+                except Exception as e:
+                    print(f"Skipping {filename}: {e}")
+            if text:
+                names.append(filename)
+                texts.append(text)
+            else:
+                skipped.append(filename)
+    return names, texts, skipped
+
+def rank_resumes(resume_texts, job_descs, top_k=10, batch_size=64):
+    """Embeds every document once and scores all resumes against all JDs with one matrix multiply.
+
+    Returns, per job description, the top-k (resume index, score in %) pairs.
+    """
+    resume_emb = embedder.encode([clean_text(t) for t in resume_texts], batch_size=batch_size,
+                                 convert_to_tensor=True, normalize_embeddings=True)
+    jd_emb = embedder.encode([clean_text(jd) for jd in job_descs], batch_size=batch_size,
+                             convert_to_tensor=True, normalize_embeddings=True)
+    scores = jd_emb @ resume_emb.T  # (num_jds, num_resumes) cosine similarities
+    top_scores, top_indices = torch.topk(scores, k=min(top_k, len(resume_texts)), dim=1)
+    return [
+        [(index, round(score * 100, 2)) for index, score in zip(indices.tolist(), row_scores.tolist())]
+        for indices, row_scores in zip(top_indices, top_scores)
+    ]
+
 def generate_cover_letter(name, title, company):
     return f"""Dear Hiring Manager,
 
@@ -95,20 +465,18 @@ Sincerely,
 @app.post("/analyze/")
 async def analyze(resume_file: UploadFile, job_desc: str = Form(...), user_name: str = Form("")):
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(await resume_file.read())
-            tmp_path = tmp.name
-
-        if resume_file.filename.endswith(".pdf"):
-            resume_text = extract_text_from_pdf(tmp_path)
-        elif resume_file.filename.lower().endswith((".png", ".jpg", ".jpeg")):
-            resume_text = extract_text_from_image(tmp_path)
-        else:
+        data = await resume_file.read()
+        resume_key = document_cache.key_for(data)
+
+        # Parsing and OCR are CPU-bound; keep them off the event loop
+        resume_text = await run_in_threadpool(extract_resume_text, resume_file.filename, data, resume_key)
+        if resume_text is None:
             return JSONResponse(content={"error": "Unsupported file type"}, status_code=400)
 
         name = user_name if user_name.strip() else extract_name(resume_text)
         job_title, company = extract_job_info(job_desc)
-        ats_score = compute_ats_score(resume_text, job_desc)
+        # Run off the event loop so concurrent requests can be coalesced into one batch
+        ats_score = await run_in_threadpool(compute_ats_score, resume_text, job_desc, resume_key)
         letter = generate_cover_letter(name, job_title, company)
 
         return {
@@ -118,6 +486,56 @@ async def analyze(resume_file: UploadFile, job_desc: str = Form(...), user_name:
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.post("/rank/")
+async def rank(resume_files: List[UploadFile] = File(...), job_descs: List[str] = Form(...), top_k: int = Form(10)):
+    """Scores many resumes (files or .zip archives) against many job descriptions and returns a top-k per JD."""
+    try:
+        uploads = [(resume_file.filename, await resume_file.read()) for resume_file in resume_files]
+
+        names, texts, skipped = await run_in_threadpool(extract_uploads, uploads)
+        if not texts:
+            return JSONResponse(content={"error": "No readable resumes found", "skipped": skipped}, status_code=400)
+
+        rankings = await run_in_threadpool(rank_resumes, texts, job_descs, top_k)
+        return {
+            "rankings": [
+                {
+                    "job_index": jd_index,
+                    "job_title": extract_job_info(job_descs[jd_index])[0],
+                    "top": [{"resume": names[i], "ats_score": f"{score}%"} for i, score in ranking],
+                }
+                for jd_index, ranking in enumerate(rankings)
+            ],
+            "skipped": skipped
+        }
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+@app.post("/resumes/")
+async def add_resumes(resume_files: List[UploadFile] = File(...)):
+    """Parses and embeds resumes (files or .zip archives) once and adds them to the persistent corpus."""
+    try:
+        uploads = [(resume_file.filename, await resume_file.read()) for resume_file in resume_files]
+
+        def ingest():
+            names, texts, skipped = extract_uploads(uploads)
+            ids = resume_store.add(names, texts) if texts else []
+            return ids, names, skipped
+
+        ids, names, skipped = await run_in_threadpool(ingest)
+        return {"added": [{"id": i, "filename": name} for i, name in zip(ids, names)], "skipped": skipped}
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+@app.post("/resumes/search/")
+async def search_resumes(job_desc: str = Form(...), top_k: int = Form(10)):
+    """Finds the best stored candidates for a job description."""
+    try:
+        candidates = await run_in_threadpool(resume_store.search, job_desc, top_k)
+        return {"job_title": extract_job_info(job_desc)[0], "candidates": candidates}
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
 # STEP 7: Start server with ngrok
 def start_server():
     try:
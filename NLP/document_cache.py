@@ -0,0 +1,96 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class DocumentCache:
+    """Maps a file's SHA-256 to its cleaned text and its `embedding_model` resume embedding.
+
+    Recent entries are kept in an in-memory LRU; everything is also written to `directory`,
+    which is trimmed (least recently used first) to `max_disk_bytes`. Embeddings are stored
+    per model name, so apps using different models can share one directory.
+    """
+
+    def __init__(self, embedding_model, directory="document_cache", max_memory_items=256, max_disk_bytes=512 * 1024 ** 2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._model_tag = hashlib.sha256(embedding_model.encode("utf-8")).hexdigest()[:16]
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # (key, kind) -> value
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, f"{key}.txt" if kind == "text" else f"{key}.{self._model_tag}.npy")
+
+    def _get(self, key, kind):
+        with self._lock:
+            if (key, kind) in self._memory:
+                self._memory.move_to_end((key, kind))
+                return self._memory[(key, kind)]
+        path = self._path(key, kind)
+        if not os.path.exists(path):
+            return None
+        try:
+            if kind == "text":
+                with open(path, encoding="utf-8") as f:
+                    value = f.read()
+            else:
+                value = np.load(path)
+            os.utime(path)  # Marks the entry as recently used for disk eviction
+        except (OSError, ValueError):
+            return None
+        self._remember(key, kind, value)
+        return value
+
+    def _put(self, key, kind, value):
+        path = self._path(key, kind)
+        if kind == "text":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(value)
+        else:
+            np.save(path, value)
+        self._remember(key, kind, value)
+        self._trim_disk()
+
+    def _remember(self, key, kind, value):
+        with self._lock:
+            self._memory[(key, kind)] = value
+            self._memory.move_to_end((key, kind))
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def _trim_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:  # Removed meanwhile by another process sharing the directory
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def get_text(self, key):
+        return self._get(key, "text")
+
+    def put_text(self, key, text):
+        self._put(key, "text", text)
+
+    def get_embedding(self, key):
+        return self._get(key, "embedding")
+
+    def put_embedding(self, key, embedding):
+        self._put(key, "embedding", np.asarray(embedding, dtype=np.float32))
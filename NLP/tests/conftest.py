@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Shared modules in NLP/ are imported by bare name, as the notebooks next to them do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,188 @@
+import time
+import asyncio
+import pytest
+import torch
+from transformers import MistralConfig, MistralForCausalLM
+
+from text_generation import ContinuousBatchingScheduler, PrefixCache, SpeculativeDecoder, benchmark_decoding, generate_kwargs
+
+class CharTokenizer:
+    """One token per character; decodes to space-separated IDs so outputs compare exactly."""
+    pad_token_id = 0
+
+    def __init__(self, eos_token_id=99):
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, text):
+        class Encoding:
+            input_ids = [1] + [2 + ord(c) % 90 for c in text]
+        return Encoding()
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(map(str, ids))
+
+def tiny_model(vocab_size=100):
+    torch.manual_seed(0)
+    config = MistralConfig(vocab_size=vocab_size, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                           num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512)
+    return MistralForCausalLM(config).eval()
+
+@pytest.fixture(scope="module")
+def model():
+    return tiny_model()
+
+def reference(model, tokenizer, prompt, max_new_tokens):
+    input_ids = torch.tensor([tokenizer(prompt).input_ids])
+    output = model.generate(input_ids, max_new_tokens=max_new_tokens, do_sample=False,
+                            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    return tokenizer.decode([t for t in output[0, input_ids.shape[1]:].tolist() if t != tokenizer.eos_token_id])
+
+def wait_until(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+def test_greedy_matches_generate_with_staggered_joins(model):
+    tokenizer = CharTokenizer()
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, max_batch_size=4)
+    prompts = ["hello there", "a much longer prompt to exercise left padding", "x", "two rows"]
+    futures = []
+    for prompt in prompts:
+        futures.append(scheduler.submit(prompt, max_new_tokens=12, temperature=0))
+        time.sleep(0.01)
+    for prompt, future in zip(prompts, futures):
+        assert future.result(timeout=60) == reference(model, tokenizer, prompt, 12)
+
+def test_prefix_cache_matches_generate(model):
+    tokenizer = CharTokenizer()
+    prefix = "You are a comedian. Topic:"
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, max_batch_size=4,
+                                            prefix_cache=PrefixCache(model, tokenizer))
+    prompts = [prefix + " cats", prefix + " a very long topic about dogs", "no template"]
+    futures = [scheduler.submit(p, max_new_tokens=10, temperature=0, prefix=prefix if p.startswith(prefix) else None)
+               for p in prompts]
+    for prompt, future in zip(prompts, futures):
+        assert future.result(timeout=60) == reference(model, tokenizer, prompt, 10)
+
+def test_cancelled_request_is_dropped_mid_batch(model):
+    tokenizer = CharTokenizer(eos_token_id=1000)  # Never sampled, so rows run until cancelled or their budget
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, max_batch_size=4)
+
+    async def run():
+        cancelled = asyncio.ensure_future(scheduler.generate("cancel me", max_new_tokens=400, temperature=0.9))
+        bystander = scheduler.submit("bystander", max_new_tokens=60, temperature=0.9)
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._active) == 2 and
+                                all(r.generated for r in scheduler._active))
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._active) <= 1)
+        assert all(not r.cancelled for r in scheduler._active)
+        return await asyncio.wrap_future(bystander)
+
+    assert len(asyncio.run(run()).split()) == 60
+    # The scheduler thread survived and keeps serving requests.
+    assert len(scheduler.submit("later", max_new_tokens=5, temperature=0).result(timeout=30).split()) == 5
+
+@pytest.fixture(scope="module")
+def byte_level_tokenizer():
+    # Byte-level BPE, so random generations include characters split across tokens.
+    tokenizers = pytest.importorskip("tokenizers")
+    from transformers import PreTrainedTokenizerFast
+    bpe = tokenizers.ByteLevelBPETokenizer()
+    bpe.train_from_iterator(["the cat sat on the mat, naïve café 😀 jokes about dogs"] * 10, vocab_size=300,
+                            min_frequency=1, special_tokens=["<pad>", "</s>"], show_progress=False)
+    return PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, pad_token="<pad>", eos_token="</s>")
+
+def test_stream_pieces_add_up_to_result(byte_level_tokenizer):
+    model = tiny_model(vocab_size=len(byte_level_tokenizer))
+    scheduler = ContinuousBatchingScheduler(model, byte_level_tokenizer, max_batch_size=4)
+    for seed in range(5):
+        torch.manual_seed(seed)
+        pieces = []
+        result = scheduler.submit("the cat", max_new_tokens=40, temperature=1.5, on_text=pieces.append).result(timeout=30)
+        wait_until(lambda: pieces and pieces[-1] is None)
+        streamed = "".join(pieces[:-1])
+        # Only a trailing incomplete character is held back (random bytes can also be invalid UTF-8 mid-text)
+        assert streamed.rstrip() == result.rstrip("\ufffd").rstrip()
+
+def test_closing_stream_cancels_generation(model):
+    tokenizer = CharTokenizer(eos_token_id=1000)
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, max_batch_size=4)
+
+    async def run():
+        stream = scheduler.stream("disconnect", max_new_tokens=400, temperature=0.9)
+        await stream.__anext__()
+        request = scheduler._active[0]
+        await stream.aclose()  # What aclosing() does when the SSE handler returns on a disconnect
+        assert request.cancelled
+        await asyncio.to_thread(wait_until, lambda: not scheduler._active)
+        assert len(request.generated) < 400
+
+    asyncio.run(run())
+
+def test_failing_stream_callback_only_cancels_its_request(model):
+    tokenizer = CharTokenizer(eos_token_id=1000)
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, max_batch_size=4)
+
+    def broken(piece):
+        raise RuntimeError("Event loop is closed")
+
+    failing = scheduler.submit("stream", max_new_tokens=20, temperature=0, on_text=broken)
+    other = scheduler.submit("batch", max_new_tokens=20, temperature=0)
+    assert len(other.result(timeout=30).split()) == 20
+    assert failing.cancelled()
+
+@pytest.fixture(scope="module")
+def speculative_pair():
+    tokenizers = pytest.importorskip("tokenizers")
+    from transformers import PreTrainedTokenizerFast
+    vocab = {"<pad>": 0, "<s>": 1, "</s>": 2}
+    for i, char in enumerate("abcdefghijklmnopqrstuvwxyz .:!\n"):
+        vocab[char] = 3 + i
+    char_level = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<pad>"))
+    char_level.pre_tokenizer = tokenizers.pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=char_level, eos_token="</s>", pad_token="<pad>", bos_token="<s>")
+
+    def make(layers, hidden):
+        config = MistralConfig(vocab_size=len(vocab), hidden_size=hidden, intermediate_size=2 * hidden,
+                               num_hidden_layers=layers, num_attention_heads=4, num_key_value_heads=2,
+                               eos_token_id=2, pad_token_id=0, bos_token_id=1)
+        model = MistralForCausalLM(config).eval()
+        with torch.no_grad():
+            model.lm_head.weight[:3] = -1  # Keep special tokens out of greedy outputs so lengths are fixed
+        return model
+
+    torch.manual_seed(0)
+    model, draft = make(4, 128), make(1, 64)
+    draft.generation_config.num_assistant_tokens = 5
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    return model, tokenizer, draft
+
+def test_speculative_greedy_matches_plain_greedy(speculative_pair):
+    model, tokenizer, draft = speculative_pair
+    decoder = SpeculativeDecoder(model, tokenizer, draft)
+    for prompt in ["tell me a joke about cats:", "dogs:"]:
+        kwargs = generate_kwargs(model, tokenizer, prompt, 30, 0.0)
+        plain = tokenizer.decode(model.generate(**kwargs)[0, kwargs["input_ids"].shape[1]:], skip_special_tokens=True).strip()
+        assert decoder.submit(prompt, max_new_tokens=30, temperature=0.0).result(timeout=60) == plain
+
+        async def stream():
+            return "".join([piece async for piece in decoder.stream(prompt, max_new_tokens=30, temperature=0.0)])
+
+        assert asyncio.run(stream()).strip() == plain
+
+def test_speculative_requests_share_a_bounded_pool(speculative_pair):
+    model, tokenizer, draft = speculative_pair
+    decoder = SpeculativeDecoder(model, tokenizer, draft, max_workers=2)
+    futures = [decoder.submit("cats:", max_new_tokens=5, temperature=0.9) for _ in range(6)]
+    for future in futures:
+        future.result(timeout=60)
+    assert len(decoder._executor._threads) == 2
+
+def test_benchmark_decoding_runs_on_small_models(speculative_pair):
+    model, tokenizer, draft = speculative_pair
+    results = benchmark_decoding(["cats:", "dogs:"], model, tokenizer, draft, max_new_tokens=10, temperature=0.0, runs=1)
+    assert results["baseline"]["tokens"] == results["speculative"]["tokens"] == 20
+    assert results["speedup"] > 0
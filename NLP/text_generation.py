@@ -0,0 +1,457 @@
+"""Continuous batching and speculative text generation for causal LMs.
+
+Used by the comedy generator notebook; works with any causal LM and tokenizer pair, so it
+can be exercised on CPU with a tiny stand-in model. Run this module to benchmark speculative
+decoding with a small main/draft pair:
+
+    python text_generation.py --model HuggingFaceTB/SmolLM2-360M --draft HuggingFaceTB/SmolLM2-135M
+"""
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+import torch
+from transformers import DynamicCache, AsyncTextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+
+def _cache_to_tensors(cache):
+    """Returns [(keys, values), ...] per layer, each shaped (batch, heads, seq, head_dim)."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "to_legacy_cache"):
+        return list(cache.to_legacy_cache())
+    return list(cache)
+
+def _tensors_to_cache(kv):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(kv))
+    return DynamicCache(ddp_cache_data=kv)
+
+def sample_next_tokens(logits, temperatures, top_k=50, top_p=0.95):
+    """Samples one token per row with that row's temperature, then top-k and top-p filtering (temperature <= 0 is greedy)."""
+    greedy = temperatures <= 0
+    logits = logits / torch.where(greedy, torch.ones_like(temperatures), temperatures).unsqueeze(1)
+    if top_k:
+        kth_value = torch.topk(logits, min(top_k, logits.size(-1)), dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth_value, float("-inf"))
+    if top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=True, dim=-1)
+        cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        # Drop tokens once the cumulative probability of the tokens before them exceeds top_p
+        sorted_remove = (cumulative - sorted_logits.softmax(dim=-1)) > top_p
+        remove = sorted_remove.scatter(1, sorted_indices, sorted_remove)
+        logits = logits.masked_fill(remove, float("-inf"))
+    sampled = torch.multinomial(logits.softmax(dim=-1), num_samples=1).squeeze(1)
+    return torch.where(greedy, logits.argmax(dim=-1), sampled)
+
+class PrefixCache:
+    """Keeps the past key/values of fixed prompt prefixes (the per-mode templates) for reuse across requests.
+
+    Entries are computed on first use and evicted least recently used first beyond `max_entries`.
+    Reuse is decided on token IDs: a request reuses the cached positions its own prompt tokens
+    share with the prefix, so a tokenizer merging across the prefix boundary only shortens the reuse.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # prefix text -> (token ids, [(keys, values)] with batch size 1)
+        self._lock = threading.Lock()
+
+    def get(self, prefix):
+        with self._lock:
+            if prefix in self._entries:
+                self._entries.move_to_end(prefix)
+                return self._entries[prefix]
+        prefix_ids = self.tokenizer(prefix).input_ids
+        input_ids = torch.tensor([prefix_ids], device=self.model.device)
+        with torch.inference_mode():
+            outputs = self.model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                 past_key_values=DynamicCache(), use_cache=True)
+        entry = (prefix_ids, _cache_to_tensors(outputs.past_key_values))
+        with self._lock:
+            self._entries[prefix] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def match(self, prompt_ids, prefix):
+        """Returns (number of reusable positions, cached key/values) for a prompt built on `prefix`."""
+        prefix_ids, kv = self.get(prefix)
+        shared = 0
+        # Keep at least one prompt token to prefill so the last position yields logits.
+        limit = min(len(prefix_ids), len(prompt_ids) - 1)
+        while shared < limit and prefix_ids[shared] == prompt_ids[shared]:
+            shared += 1
+        return shared, kv
+
+class GenerationRequest:
+    def __init__(self, prompt_ids, max_new_tokens, temperature, on_text=None, prefix=None):
+        self.prompt_ids = prompt_ids
+        self.prefix = prefix  # Template text the prompt starts with, for prefix cache reuse
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.generated = []
+        self.future = Future()
+        self.on_text = on_text  # Called with each newly decoded piece of text, then with None when finished
+        # Streaming decodes only generated[prefix_offset:]: text up to read_offset has been sent already.
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.text_started = False
+
+    @property
+    def cancelled(self):
+        # The caller gave up (e.g. the awaiting handler was cancelled when its client disconnected)
+        return self.future.cancelled()
+
+    def send_text(self, piece):
+        """Passes `piece` to on_text. A failing callback (e.g. its event loop is gone) cancels the request."""
+        try:
+            self.on_text(piece)
+        except Exception:
+            self.future.cancel()
+
+    def finish(self, result=None, error=None):
+        try:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        except InvalidStateError:
+            return  # Already cancelled; nobody is waiting for the result
+        if self.on_text is not None:
+            self.send_text(None)
+
+class ContinuousBatchingScheduler:
+    """Runs many generation requests through one model in a shared, padded batch.
+
+    Batching happens at the iteration level: every decode step advances all active
+    requests by one token, finished requests leave the batch immediately, and queued
+    requests are prefilled and merged into the running batch between steps. Each
+    request keeps its own temperature and token budget. Works with any causal LM and
+    tokenizer pair, so it can be exercised on CPU with a tiny stand-in model.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, top_k=50, top_p=0.95, prefix_cache=None):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.top_k = top_k
+        self.top_p = top_p
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self._waiting = queue.Queue()
+        self._reset_batch()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _reset_batch(self):
+        self._active = []            # GenerationRequest per batch row
+        self._kv = None              # [(keys, values)] per layer, left-padded along seq
+        self._attention_mask = None  # (rows, seq) mask over the cached positions
+        self._next_tokens = None     # (rows,) sampled tokens not yet fed to the model
+
+    def submit(self, prompt, max_new_tokens=100, temperature=0.9, on_text=None, prefix=None):
+        """Queues a prompt; returns a Future resolving to the generated text (prompt excluded).
+
+        `prefix` names the template text the prompt starts with so its cached key/values can be reused.
+        """
+        prompt_ids = self.tokenizer(prompt).input_ids
+        request = GenerationRequest(prompt_ids, max_new_tokens, temperature, on_text, prefix)
+        self._waiting.put(request)
+        return request.future
+
+    async def generate(self, prompt, max_new_tokens=100, temperature=0.9, prefix=None):
+        return await asyncio.wrap_future(self.submit(prompt, max_new_tokens, temperature, prefix=prefix))
+
+    async def stream(self, prompt, max_new_tokens=100, temperature=0.9, prefix=None):
+        """Yields pieces of generated text as tokens are sampled."""
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        future = self.submit(prompt, max_new_tokens, temperature,
+                             on_text=lambda piece: loop.call_soon_threadsafe(pieces.put_nowait, piece), prefix=prefix)
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    break
+                yield piece
+        finally:
+            # No-op once finished; otherwise the consumer went away (e.g. client disconnected), so stop generating.
+            future.cancel()
+        future.result()  # Re-raises a generation error after the stream ends
+
+    def _run(self):
+        while True:
+            try:
+                # When idle, block until work arrives instead of spinning.
+                first = None if self._active else self._waiting.get()
+                with torch.inference_mode():
+                    self._admit(first)
+                    if self._active:
+                        self._step()
+            except Exception as e:
+                # Fail the running batch, but never let an error stop the scheduler thread.
+                for request in self._active:
+                    request.finish(error=e)
+                self._reset_batch()
+
+    def _admit(self, first=None):
+        new_requests = [first] if first is not None and not first.cancelled else []
+        while len(self._active) + len(new_requests) < self.max_batch_size:
+            try:
+                request = self._waiting.get_nowait()
+            except queue.Empty:
+                break
+            if not request.cancelled:
+                new_requests.append(request)
+        if not new_requests:
+            return
+
+        try:
+            input_ids, attention_mask, position_ids, past = self._prefill_inputs(new_requests)
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                                 past_key_values=past, use_cache=True)
+            temperatures = torch.tensor([r.temperature for r in new_requests], device=self.model.device, dtype=torch.float)
+            next_tokens = sample_next_tokens(outputs.logits[:, -1, :].float(), temperatures, self.top_k, self.top_p)
+        except Exception as e:
+            # Fail only the requests being admitted; the running batch is untouched.
+            for request in new_requests:
+                request.finish(error=e)
+            return
+        first_new_row = len(self._active)
+        self._merge(new_requests, _cache_to_tensors(outputs.past_key_values), attention_mask, next_tokens)
+        self._record(next_tokens, first_row=first_new_row)
+
+    def _prefill_inputs(self, requests):
+        """Builds the prefill batch. Cached prefix positions go into the past key/values (left-padded),
+        and only the remaining prompt tokens are fed to the model (also left-padded)."""
+        device = self.model.device
+        matches = [
+            self.prefix_cache.match(r.prompt_ids, r.prefix) if self.prefix_cache is not None and r.prefix else (0, None)
+            for r in requests
+        ]
+        cached_length = max(shared for shared, _ in matches)
+        length = max(len(r.prompt_ids) - shared for r, (shared, _) in zip(requests, matches))
+
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long, device=device)
+        attention_mask = torch.zeros((len(requests), cached_length + length), dtype=torch.long, device=device)
+        for row, (request, (shared, _)) in enumerate(zip(requests, matches)):
+            remaining = request.prompt_ids[shared:]
+            input_ids[row, length - len(remaining):] = torch.tensor(remaining, device=device)
+            attention_mask[row, cached_length - shared:cached_length] = 1
+            attention_mask[row, cached_length + length - len(remaining):] = 1
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)[:, cached_length:]
+
+        if cached_length == 0:
+            return input_ids, attention_mask, position_ids, DynamicCache()
+        template = next(kv for shared, kv in matches if shared)
+        past = []
+        for layer, (keys, values) in enumerate(template):
+            batch_keys = keys.new_zeros((len(requests), keys.size(1), cached_length, keys.size(3)))
+            batch_values = values.new_zeros((len(requests), values.size(1), cached_length, values.size(3)))
+            for row, (shared, kv) in enumerate(matches):
+                if shared:
+                    batch_keys[row, :, cached_length - shared:] = kv[layer][0][0, :, :shared]
+                    batch_values[row, :, cached_length - shared:] = kv[layer][1][0, :, :shared]
+            past.append((batch_keys, batch_values))
+        return input_ids, attention_mask, position_ids, _tensors_to_cache(past)
+
+    def _merge(self, requests, kv, attention_mask, next_tokens):
+        """Appends prefilled rows to the running batch, left-padding whichever side is shorter."""
+        if not self._active:
+            self._active, self._kv, self._attention_mask, self._next_tokens = list(requests), kv, attention_mask, next_tokens
+            return
+
+        def left_pad(tensor, target, dim):
+            missing = target - tensor.size(dim)
+            if missing == 0:
+                return tensor
+            shape = list(tensor.shape)
+            shape[dim] = missing
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+        length = max(self._attention_mask.size(1), attention_mask.size(1))
+        self._kv = [
+            (torch.cat([left_pad(k_old, length, 2), left_pad(k_new, length, 2)]),
+             torch.cat([left_pad(v_old, length, 2), left_pad(v_new, length, 2)]))
+            for (k_old, v_old), (k_new, v_new) in zip(self._kv, kv)
+        ]
+        self._attention_mask = torch.cat([left_pad(self._attention_mask, length, 1), left_pad(attention_mask, length, 1)])
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        self._active.extend(requests)
+
+    def _step(self):
+        position_ids = self._attention_mask.sum(dim=1, keepdim=True)
+        self._attention_mask = torch.cat([self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))], dim=1)
+        outputs = self.model(input_ids=self._next_tokens.unsqueeze(1), attention_mask=self._attention_mask,
+                             position_ids=position_ids, past_key_values=_tensors_to_cache(self._kv), use_cache=True)
+        self._kv = _cache_to_tensors(outputs.past_key_values)
+        temperatures = torch.tensor([r.temperature for r in self._active], device=self.model.device, dtype=torch.float)
+        self._next_tokens = sample_next_tokens(outputs.logits[:, -1, :].float(), temperatures, self.top_k, self.top_p)
+        self._record(self._next_tokens)
+
+    def _emit_text(self, request):
+        # Decode the tokens since the last sent piece together with the ones just before it, and send
+        # the new suffix: tokenizer spacing and multi-token characters come out right without
+        # re-decoding the whole continuation on every step.
+        sent = self.tokenizer.decode(request.generated[request.prefix_offset:request.read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(request.generated[request.prefix_offset:], skip_special_tokens=True)
+        if text.endswith("\ufffd") or len(text) <= len(sent):
+            return  # Incomplete multi-byte character, or nothing visible yet; wait for the next token
+        piece = text[len(sent):]
+        if not request.text_started:
+            piece = piece.lstrip()  # Like the final result, the stream starts at the first visible character
+        request.prefix_offset, request.read_offset = request.read_offset, len(request.generated)
+        if piece:
+            request.text_started = True
+            request.send_text(piece)
+
+    def _record(self, tokens, first_row=0):
+        """Appends new tokens to rows `first_row` onwards, then retires rows that hit EOS or their token
+        budget. Rows whose request was cancelled are dropped without a result."""
+        keep = list(range(first_row))
+        for row, token in enumerate(tokens.tolist(), start=first_row):
+            request = self._active[row]
+            if request.cancelled:
+                continue
+            if token != self.eos_token_id:
+                request.generated.append(token)
+                if request.on_text is not None:
+                    self._emit_text(request)
+            if token == self.eos_token_id or len(request.generated) >= request.max_new_tokens:
+                request.finish(self.tokenizer.decode(request.generated, skip_special_tokens=True).strip())
+            elif not request.cancelled:
+                keep.append(row)
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset_batch()
+            return
+
+        index = torch.tensor(keep, device=self._attention_mask.device)
+        self._active = [self._active[row] for row in keep]
+        self._attention_mask = self._attention_mask[index]
+        self._next_tokens = self._next_tokens[index]
+        # Drop leading columns that are padding for every remaining row.
+        start = int((self._attention_mask.cumsum(dim=1) == 0).sum(dim=1).min())
+        self._attention_mask = self._attention_mask[:, start:]
+        self._kv = [(k[index, :, start:], v[index, :, start:]) for k, v in self._kv]
+
+def generate_kwargs(model, tokenizer, prompt, max_new_tokens, temperature, assistant_model=None, top_k=50, top_p=0.95):
+    """generate() arguments using the same sampling settings as the batching scheduler (temperature <= 0 is greedy)."""
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    kwargs = dict(**inputs, max_new_tokens=max_new_tokens, pad_token_id=tokenizer.eos_token_id)
+    if temperature > 0:
+        kwargs.update(do_sample=True, temperature=temperature, top_k=top_k, top_p=top_p)
+    else:
+        kwargs.update(do_sample=False)
+    if assistant_model is not None:
+        kwargs["assistant_model"] = assistant_model
+    return kwargs
+
+class StopOnEvent(StoppingCriteria):
+    """Stops generate() once `event` is set, e.g. when the client of a stream disconnected."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+class SpeculativeDecoder:
+    """Assisted (speculative) generation: the draft model proposes tokens and the main model verifies
+    them in one forward pass. With sampling, transformers' speculative sampling keeps the main model's
+    top-k/top-p distribution; greedy outputs match plain greedy decoding.
+
+    Assisted generation runs one request at a time, so requests queue for a bounded pool of
+    `max_workers` generation threads.
+    """
+
+    def __init__(self, model, tokenizer, assistant_model, max_workers=1, top_k=50, top_p=0.95):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.assistant_model = assistant_model
+        self.top_k = top_k
+        self.top_p = top_p
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+
+    def _generate(self, prompt, max_new_tokens, temperature, streamer=None, stop=None):
+        kwargs = generate_kwargs(self.model, self.tokenizer, prompt, max_new_tokens, temperature,
+                                 self.assistant_model, self.top_k, self.top_p)
+        if stop is not None:
+            kwargs["stopping_criteria"] = StoppingCriteriaList([StopOnEvent(stop)])
+        with torch.inference_mode():
+            output = self.model.generate(**kwargs, streamer=streamer)
+        return self.tokenizer.decode(output[0, kwargs["input_ids"].shape[1]:], skip_special_tokens=True).strip()
+
+    def submit(self, prompt, max_new_tokens=100, temperature=0.9):
+        """Queues a prompt; returns a Future resolving to the generated text (prompt excluded)."""
+        return self._executor.submit(self._generate, prompt, max_new_tokens, temperature)
+
+    async def generate(self, prompt, max_new_tokens=100, temperature=0.9):
+        return await asyncio.wrap_future(self.submit(prompt, max_new_tokens, temperature))
+
+    async def stream(self, prompt, max_new_tokens=100, temperature=0.9):
+        """Yields pieces of generated text; closing the generator stops the generation."""
+        streamer = AsyncTextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+
+        def run():
+            try:
+                return self._generate(prompt, max_new_tokens, temperature, streamer, stop)
+            except Exception:
+                streamer.end()
+                raise
+
+        future = self._executor.submit(run)
+        try:
+            async for piece in streamer:
+                if piece:
+                    yield piece
+        finally:
+            # The consumer went away (or generation ended): drop a queued request, stop a running one
+            future.cancel()
+            stop.set()
+        await asyncio.wrap_future(future)  # Re-raises a generation error after the stream ends
+
+def benchmark_decoding(prompts, model, tokenizer, assistant_model, max_new_tokens=100, temperature=0.9, runs=3):
+    """Compares generated tokens/sec with and without the draft model on the same prompts."""
+    results = {}
+    for label, assistant in (("baseline", None), ("speculative", assistant_model)):
+        generated, elapsed = 0, 0.0
+        for _ in range(runs):
+            for prompt in prompts:
+                kwargs = generate_kwargs(model, tokenizer, prompt, max_new_tokens, temperature, assistant)
+                start = time.perf_counter()
+                with torch.inference_mode():
+                    output = model.generate(**kwargs)
+                elapsed += time.perf_counter() - start
+                generated += output.shape[1] - kwargs["input_ids"].shape[1]
+        results[label] = {"tokens": generated, "seconds": round(elapsed, 3), "tokens_per_second": round(generated / elapsed, 2)}
+    results["speedup"] = round(results["speculative"]["tokens_per_second"] / results["baseline"]["tokens_per_second"], 2)
+    return results
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding against plain decoding.")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-360M")
+    parser.add_argument("--draft", default="HuggingFaceTB/SmolLM2-135M", help="Must share the main model's tokenizer")
+    parser.add_argument("--draft-tokens", type=int, default=5)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    draft = AutoModelForCausalLM.from_pretrained(args.draft).eval()
+    draft.generation_config.num_assistant_tokens = args.draft_tokens
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    prompts = ["Tell me a joke about cats.", "Write a pick-up line about coffee.", "A stand-up routine about Mondays:"]
+    print(json.dumps(benchmark_decoding(prompts, model, tokenizer, draft, args.max_new_tokens, args.temperature, args.runs), indent=2))
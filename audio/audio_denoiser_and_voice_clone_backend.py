@@ -14,13 +14,19 @@ Original file is located at
 import os
 import uvicorn
 import torch
-import librosa
 import noisereduce as nr
 import soundfile as sf
+import re
+import queue
+import struct
+import hashlib
 import tempfile
+import threading
+import numpy as np
 import nest_asyncio
 from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pyngrok import ngrok
 from TTS.api import TTS
@@ -74,42 +80,270 @@ app.add_middleware(
 def read_root():
     return {"message": "Welcome to the Voice Cloning API! Visit /docs to try it out."}
 
-# Voice Cloning Endpoint
-@app.post("/clone/")
-async def clone_voice(text: str = Form(...), audio: UploadFile = File(...)):
-    try:
+# WAV streaming helpers (shared by /clone/ and /denoise/)
+UNKNOWN_WAV_LENGTH = 0xFFFFFFFF  # Header size for streams whose length isn't known up front
+
+def wav_header(sample_rate, num_frames=None, channels=1, bits_per_sample=16):
+    """RIFF/WAVE header for 16-bit PCM. Without `num_frames` the sizes are set to the maximum, which players treat as "read to end"."""
+    block_align = channels * bits_per_sample // 8
+    data_size = num_frames * block_align if num_frames else UNKNOWN_WAV_LENGTH - 36
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", min(36 + data_size, UNKNOWN_WAV_LENGTH), b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b"data", data_size,
+    )
+
+def _to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+# Voice registry: XTTS conditioning latents and speaker embedding per reference audio, keyed by
+# the audio's SHA-256, kept in memory and on disk so a voice is only analysed once.
+VOICES_DIR = os.environ.get("VOICES_DIR", "voices")
+xtts_model = tts.synthesizer.tts_model
+# XTTS isn't safe to run from several threads at once (shared GPT cache, CUDA memory), so every
+# model call (latents and synthesis) holds this lock; concurrent /clone/ streams take turns per batch.
+xtts_lock = threading.Lock()
+
+class VoiceRegistry:
+    def __init__(self, model, model_lock, directory=VOICES_DIR):
+        self.model = model
+        self.model_lock = model_lock
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._voices = {}
+        self._lock = threading.Lock()
+
+    def _path(self, voice_id):
+        return os.path.join(self.directory, f"{voice_id}.pt")
+
+    def get(self, voice_id):
+        """Returns (gpt_cond_latent, speaker_embedding) for a registered voice, or None."""
+        with self._lock:
+            if voice_id in self._voices:
+                return self._voices[voice_id]
+        # voice_ids are SHA-256 hex digests; anything else could point outside the directory
+        if len(voice_id) != 64 or not all(c in "0123456789abcdef" for c in voice_id):
+            return None
+        if not os.path.exists(self._path(voice_id)):
+            return None
+        saved = torch.load(self._path(voice_id), map_location=device)
+        latents = (saved["gpt_cond_latent"], saved["speaker_embedding"])
+        with self._lock:
+            self._voices[voice_id] = latents
+        return latents
+
+    def register(self, audio_file):
+        """Computes the latents for a reference audio file object unless already known. Returns (voice_id, created)."""
+        digest = hashlib.sha256()
+        audio_file.seek(0)
+        for block in iter(lambda: audio_file.read(1024 * 1024), b""):
+            digest.update(block)
+        voice_id = digest.hexdigest()
+        if self.get(voice_id) is not None:
+            return voice_id, False
+
+        audio_file.seek(0)
         with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            tmp.write(await audio.read())
+            for block in iter(lambda: audio_file.read(1024 * 1024), b""):
+                tmp.write(block)
             ref_audio_path = tmp.name
+        try:
+            # Same conditioning settings tts_to_file uses for a speaker_wav
+            config = self.model.config
+            with self.model_lock:
+                gpt_cond_latent, speaker_embedding = self.model.get_conditioning_latents(
+                    audio_path=[ref_audio_path],
+                    gpt_cond_len=config.gpt_cond_len,
+                    gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+                    max_ref_length=config.max_ref_len,
+                    sound_norm_refs=config.sound_norm_refs,
+                )
+        finally:
+            os.remove(ref_audio_path)
+        torch.save({"gpt_cond_latent": gpt_cond_latent.cpu(), "speaker_embedding": speaker_embedding.cpu()},
+                   self._path(voice_id))
+        with self._lock:
+            self._voices[voice_id] = (gpt_cond_latent, speaker_embedding)
+        return voice_id, True
+
+voice_registry = VoiceRegistry(xtts_model, xtts_lock)
+
+def synthesize(text, latents, language="en"):
+    """Runs XTTS with cached latents and the model's default sampling settings; returns the waveform."""
+    gpt_cond_latent, speaker_embedding = latents
+    config = xtts_model.config
+    with xtts_lock:
+        output = xtts_model.inference(
+            text, language, gpt_cond_latent, speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+            enable_text_splitting=True,
+        )
+    return np.asarray(output["wav"], dtype=np.float32)
+
+# Streaming synthesis: the text is split into sentences, short sentences are grouped into batches
+# (one XTTS call each), and each batch's audio is streamed as soon as it is synthesized.
+CLONE_BATCH_MAX_CHARS = 200  # Below XTTS's per-call limit for English (250 characters)
+CLONE_QUEUE_SIZE = 4  # Synthesized batches buffered ahead of a slow client
+SENTENCE_PAUSE_SAMPLES = 10000  # Silence between batches, as tts_to_file inserts between sentences
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+def split_sentences(text, max_chars=CLONE_BATCH_MAX_CHARS):
+    """Splits text into sentences, breaking any sentence longer than `max_chars` at spaces."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+def batch_sentences(sentences, max_chars=CLONE_BATCH_MAX_CHARS):
+    """Groups consecutive sentences into batches of at most `max_chars`.
+
+    The first sentence is always a batch of its own so the first audio arrives after one sentence.
+    """
+    batches = []
+    for i, sentence in enumerate(sentences):
+        if i > 1 and len(batches[-1]) + 1 + len(sentence) <= max_chars:
+            batches[-1] += " " + sentence
+        else:
+            batches.append(sentence)
+    return batches
+
+def stream_synthesis(text, latents, language="en"):
+    """Yields a 16-bit WAV: the header first, then PCM for each batch as soon as it is synthesized.
+
+    A producer thread runs XTTS ahead of the client through a bounded queue; everything stays in
+    per-request memory. Stops synthesizing if the client goes away.
+    """
+    batches = batch_sentences(split_sentences(text))
+    chunks = queue.Queue(maxsize=CLONE_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
 
-        output_path = "cloned_output.wav"
-        tts.tts_to_file(text=text, speaker_wav=ref_audio_path, language="en", file_path=output_path)
+    def produce():
+        try:
+            for i, batch in enumerate(batches):
+                if stop.is_set():
+                    return
+                wav = synthesize(batch, latents, language)
+                if i < len(batches) - 1:
+                    wav = np.concatenate([wav, np.zeros(SENTENCE_PAUSE_SAMPLES, dtype=np.float32)])
+                chunks.put(_to_pcm16(wav))
+            chunks.put(done)
+        except Exception as e:
+            chunks.put(e)
 
-        return FileResponse(output_path, media_type="audio/wav", filename="cloned_output.wav")
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        yield wav_header(xtts_model.config.audio.output_sample_rate)
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full queue
+        while not chunks.empty():
+            chunks.get_nowait()
+
+# Voice Registration Endpoint
+@app.post("/voices/")
+async def register_voice(audio: UploadFile = File(...)):
+    try:
+        # Hashing the upload and computing latents block, so they run off the event loop
+        voice_id, created = await run_in_threadpool(voice_registry.register, audio.file)
+        return {"voice_id": voice_id, "created": created}
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": f"Voice cloning failed: {str(e)}"})
+        return JSONResponse(status_code=500, content={"error": f"Voice registration failed: {str(e)}"})
 
-# Audio Denoising Endpoint
-@app.post("/denoise/")
-async def denoise_audio(audio: UploadFile = File(...)):
+# Voice Cloning Endpoint
+@app.post("/clone/")
+async def clone_voice(text: str = Form(...), audio: UploadFile = File(None), voice_id: str = Form(None)):
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            tmp.write(await audio.read())
-            tmp_path = tmp.name
+        if voice_id:
+            latents = await run_in_threadpool(voice_registry.get, voice_id)  # May load from disk
+            if latents is None:
+                return JSONResponse(status_code=404, content={"error": f"Unknown voice_id: {voice_id}"})
+        elif audio is not None:
+            # A reference sent inline is registered too, so resending the same file is cheap
+            voice_id, _ = await run_in_threadpool(voice_registry.register, audio.file)
+            latents = await run_in_threadpool(voice_registry.get, voice_id)
+        else:
+            return JSONResponse(status_code=400, content={"error": "Provide either an audio reference or a voice_id."})
+
+        if not text.strip():
+            return JSONResponse(status_code=400, content={"error": "Text is empty."})
+        return StreamingResponse(
+            stream_synthesis(text, latents), media_type="audio/wav",
+            headers={"Content-Disposition": 'attachment; filename="cloned_output.wav"'}
+        )
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Voice cloning failed: {str(e)}"})
+
+# Streaming denoiser: blocks are read with soundfile and denoised one at a time, so memory stays
+# bounded by the block size no matter how long the recording is.
+DENOISE_BLOCK_SECONDS = 10.0
+DENOISE_OVERLAP_SECONDS = 0.5
+NOISE_PROFILE_SECONDS = 0.5
 
-        data, sample_rate = librosa.load(tmp_path, sr=None)
+def denoise_stream(audio_file, block_seconds=DENOISE_BLOCK_SECONDS, overlap_seconds=DENOISE_OVERLAP_SECONDS):
+    """Yields a mono 16-bit WAV of `audio_file` (path or file object) with noise reduced block by block.
 
-        # Convert to mono if stereo
-        if len(data.shape) == 2:
-            data = data[:, 0]
+    The noise profile is taken once from the first NOISE_PROFILE_SECONDS and used for every block
+    (stationary spectral gating), so blocks are denoised consistently. Consecutive blocks overlap by
+    `overlap_seconds` and are cross-faded to hide block edges.
+    """
+    with sf.SoundFile(audio_file) as f:
+        sample_rate = f.samplerate
+        num_frames = f.frames if f.frames > 0 else None
+        # Convert to mono (channel average, as librosa.load did)
+        noise_clip = f.read(int(sample_rate * NOISE_PROFILE_SECONDS), dtype="float32", always_2d=True).mean(axis=1)
+        f.seek(0)
 
-        noise_clip = data[:int(sample_rate * 0.5)]
-        reduced_noise = nr.reduce_noise(y=data, sr=sample_rate, y_noise=noise_clip)
+        overlap = int(sample_rate * overlap_seconds)
+        block_size = int(sample_rate * block_seconds)
+        fade_in = np.linspace(0.0, 1.0, overlap, endpoint=False, dtype=np.float32)
+        yield wav_header(sample_rate, num_frames)
 
-        output_file = "denoised_output.wav"
-        sf.write(output_file, reduced_noise, sample_rate)
+        tail = None  # Denoised overlap held back from the previous block
+        for block in f.blocks(blocksize=block_size + overlap, overlap=overlap, dtype="float32", always_2d=True):
+            block = block.mean(axis=1)
+            reduced = nr.reduce_noise(y=block, sr=sample_rate, y_noise=noise_clip, stationary=True).astype(np.float32)
+            if tail is not None:
+                n = min(len(tail), len(reduced))
+                reduced[:n] = tail[:n] * (1.0 - fade_in[:n]) + reduced[:n] * fade_in[:n]
+            if len(reduced) > overlap:
+                yield _to_pcm16(reduced[:-overlap])
+                tail = reduced[-overlap:]
+            else:
+                tail = reduced
+        if tail is not None:
+            yield _to_pcm16(tail)
 
-        return FileResponse(output_file, media_type="audio/wav", filename="denoised_output.wav")
+# Audio Denoising Endpoint
+@app.post("/denoise/")
+async def denoise_audio(audio: UploadFile = File(...)):
+    try:
+        # Fail fast on unreadable input, before the streaming response has started
+        sf.info(audio.file)
+        audio.file.seek(0)
+        return StreamingResponse(
+            denoise_stream(audio.file), media_type="audio/wav",
+            headers={"Content-Disposition": 'attachment; filename="denoised_output.wav"'}
+        )
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Denoising failed: {str(e)}"})
 
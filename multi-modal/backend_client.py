@@ -0,0 +1,66 @@
+import os
+import random
+import asyncio
+import httpx
+
+# Status codes that mean "try again" rather than "this request is bad".
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+# Errors raised before the backend could have started processing the request, so retrying is safe.
+# (RemoteProtocolError is excluded: the connection can drop after the backend has acted on a POST.)
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_shared_client = None
+
+def get_http_client():
+    """Returns the process-wide AsyncClient, creating it on first use (keep-alive pooled connections)."""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("GATEWAY_MAX_CONNECTIONS", 200)),
+                max_keepalive_connections=int(os.environ.get("GATEWAY_MAX_KEEPALIVE", 50)),
+                keepalive_expiry=30.0,
+            ),
+            follow_redirects=True,
+        )
+    return _shared_client
+
+async def close_http_client():
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+def _rewind_files(files):
+    # Streamed uploads are read from file objects; rewind them so a retry resends the whole body.
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) else value
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
+
+class BackendClient:
+    """Forwards requests to one model backend with a timeout, a concurrency cap and retries with backoff."""
+
+    def __init__(self, name, base_url, timeout=60.0, max_concurrency=16, retries=2, backoff=0.5):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=min(10.0, timeout))
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def post(self, path, files=None, **kwargs):
+        """POSTs to `path`, retrying connection failures and 502/503/504 with jittered exponential backoff."""
+        client = get_http_client()
+        url = f"{self.base_url}{path}"
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                _rewind_files(files)
+                try:
+                    response = await client.post(url, files=files, timeout=self.timeout, **kwargs)
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.retries:
+                        return response
+                except RETRYABLE_ERRORS:
+                    if attempt == self.retries:
+                        raise
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
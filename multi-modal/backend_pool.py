@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import random
+import asyncio
+import httpx
+from backend_client import BackendClient, get_http_client, RETRYABLE_ERRORS, RETRYABLE_STATUS_CODES
+
+class NoBackendAvailableError(Exception):
+    """Raised when every backend in a pool is unhealthy or has its circuit open."""
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    Once `reset_timeout` seconds have passed, an open breaker is eligible for one trial request;
+    it only moves to "half_open" when that backend is actually picked (`start_request`). A trial
+    that gets no answer within `trial_timeout` seconds (e.g. a cancelled hedge) frees the slot
+    for another trial. A passing health check closes the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, trial_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+
+    def allows_request(self):
+        """Whether a request may be sent now. Has no side effects."""
+        now = time.monotonic()
+        if self.state == "open":
+            return now - self.opened_at >= self.reset_timeout
+        if self.state == "half_open":
+            return now - self.trial_started_at >= self.trial_timeout
+        return True
+
+    def start_request(self):
+        """Called for the backend a request is actually sent to; starts the trial if one is due."""
+        if self.state != "closed" and self.allows_request():
+            self.state = "half_open"
+            self.trial_started_at = time.monotonic()
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        """A request ended without an answer (cancelled); let the next pick run the trial again."""
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic() - self.reset_timeout
+
+class PooledBackend:
+    """One backend replica plus the routing state the pool keeps about it."""
+
+    def __init__(self, client, breaker):
+        self.client = client
+        self.breaker = breaker
+        self.outstanding = 0
+        self.healthy = True
+
+    def status(self):
+        return {
+            "url": self.client.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "circuit": self.breaker.state,
+        }
+
+class BackendPool:
+    """Routes requests for one model type across replicas.
+
+    Picks the healthy replica with the fewest outstanding requests, skips replicas whose
+    circuit breaker is open, fails over to another replica on connection errors and
+    502/503/504, retries with backoff once every replica has been tried, and, when
+    `hedge_delay` is set, sends a second copy of slow requests to another replica and
+    returns whichever answers first.
+    """
+
+    def __init__(self, name, urls, timeout=60.0, max_concurrency=16, health_path="/", health_interval=10.0,
+                 failure_threshold=5, reset_timeout=30.0, hedge_delay=None, trial_timeout=None, retries=2, backoff=0.5):
+        if not urls:
+            raise ValueError(f"Backend pool '{name}' needs at least one URL.")
+        self.name = name
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.hedge_delay = hedge_delay
+        self.retries = retries
+        self.backoff = backoff
+        # Retries are handled by the pool (failing over first), not by re-hitting the same replica.
+        self.backends = [
+            PooledBackend(BackendClient(name, url, timeout=timeout, max_concurrency=max_concurrency, retries=0),
+                          # A trial is abandoned once it could no longer succeed within the request timeout
+                          CircuitBreaker(failure_threshold, reset_timeout, trial_timeout or timeout))
+            for url in urls
+        ]
+        self._health_task = None
+
+    def pick(self, exclude=()):
+        """Returns the available backend with the fewest outstanding requests (random among ties).
+
+        Closed breakers are preferred; otherwise a backend due for a trial request is picked,
+        and only that backend's breaker moves to half-open.
+        """
+        candidates = [b for b in self.backends if b not in exclude and b.healthy and b.breaker.state == "closed"]
+        if not candidates:
+            candidates = [b for b in self.backends if b not in exclude and b.healthy and b.breaker.allows_request()]
+        if not candidates:
+            return None
+        fewest = min(b.outstanding for b in candidates)
+        chosen = random.choice([b for b in candidates if b.outstanding == fewest])
+        chosen.breaker.start_request()
+        return chosen
+
+    async def _send(self, backend, path, kwargs):
+        backend.outstanding += 1
+        try:
+            response = await backend.client.post(path, **kwargs)
+        except asyncio.CancelledError:
+            backend.breaker.record_cancelled()
+            raise
+        except Exception:
+            backend.breaker.record_failure()
+            raise
+        finally:
+            backend.outstanding -= 1
+        if response.status_code >= 500:
+            backend.breaker.record_failure()
+        else:
+            backend.breaker.record_success()
+        return response
+
+    async def post(self, path, hedge=True, **kwargs):
+        """POSTs to `path` on the best replica, failing over once per remaining replica on
+        connection errors and 502/503/504 responses. Once every replica has been tried, the
+        round is repeated up to `retries` times with jittered exponential backoff.
+
+        Other responses, including a plain 500, are returned as is: the backend may already have
+        acted on the POST. Hedging is skipped for requests with `files`, since both copies would
+        read the same stream.
+        """
+        hedge_delay = self.hedge_delay if hedge and "files" not in kwargs else None
+        last_error = None
+        last_response = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+            tried = []
+            while len(tried) < len(self.backends):
+                backend = self.pick(exclude=tried)
+                if backend is None:
+                    break
+                tried.append(backend)
+                try:
+                    if hedge_delay is not None:
+                        response = await self._send_hedged(backend, path, kwargs, hedge_delay, tried)
+                    else:
+                        response = await self._send(backend, path, kwargs)
+                except RETRYABLE_ERRORS as e:
+                    # Only fail over when the request can't have reached the backend (see RETRYABLE_ERRORS).
+                    last_error, last_response = e, None
+                    continue
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                last_error, last_response = None, response
+            if not tried:
+                break
+        if last_response is not None:
+            return last_response
+        if last_error is not None:
+            raise last_error
+        raise NoBackendAvailableError(f"No healthy '{self.name}' backend available.")
+
+    async def _send_hedged(self, primary, path, kwargs, hedge_delay, tried):
+        primary_task = asyncio.ensure_future(self._send(primary, path, kwargs))
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_delay)
+        if done:
+            return primary_task.result()
+
+        secondary = self.pick(exclude=tried)
+        if secondary is None:
+            return await primary_task
+        tried.append(secondary)
+        tasks = {primary_task, asyncio.ensure_future(self._send(secondary, path, kwargs))}
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS_CODES:
+                        return task.result()
+            # Both copies failed: surface the primary's outcome.
+            return primary_task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def check_health(self):
+        """Probes every replica once and updates its health flag."""
+        client = get_http_client()
+
+        async def probe(backend):
+            try:
+                response = await client.get(f"{backend.client.base_url}{self.health_path}", timeout=5.0)
+                backend.healthy = response.status_code < 500
+            except httpx.HTTPError:
+                backend.healthy = False
+            if backend.healthy and backend.breaker.state != "closed":
+                backend.breaker.record_success()
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+
+    def start_health_checks(self):
+        """Starts the periodic health-check task on the running event loop."""
+        async def loop():
+            while True:
+                await self.check_health()
+                await asyncio.sleep(self.health_interval)
+
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.ensure_future(loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def status(self):
+        return [backend.status() for backend in self.backends]
+
+def load_backend_pools(defaults):
+    """Builds one BackendPool per model type.
+
+    `defaults` maps a pool name to its default settings (must include "urls"). Settings are
+    overridden by the JSON file named in GATEWAY_BACKENDS_CONFIG, e.g.
+    {"whisper": {"urls": ["http://a:8001", "http://b:8001"], "timeout": 900, "hedge_delay": 5}},
+    or by the variables <NAME>_BACKEND_URLS (comma-separated), <NAME>_TIMEOUT_SECONDS and
+    <NAME>_MAX_CONCURRENCY.
+    """
+    config = {name: dict(settings) for name, settings in defaults.items()}
+    config_path = os.environ.get("GATEWAY_BACKENDS_CONFIG")
+    if config_path:
+        with open(config_path) as f:
+            for name, settings in json.load(f).items():
+                config.setdefault(name, {}).update(settings)
+    for name, settings in config.items():
+        prefix = name.upper()
+        env_urls = os.environ.get(f"{prefix}_BACKEND_URLS")
+        if env_urls:
+            settings["urls"] = [url.strip() for url in env_urls.split(",") if url.strip()]
+        if os.environ.get(f"{prefix}_TIMEOUT_SECONDS"):
+            settings["timeout"] = float(os.environ[f"{prefix}_TIMEOUT_SECONDS"])
+        if os.environ.get(f"{prefix}_MAX_CONCURRENCY"):
+            settings["max_concurrency"] = int(os.environ[f"{prefix}_MAX_CONCURRENCY"])
+    return {name: BackendPool(name, **settings) for name, settings in config.items()}
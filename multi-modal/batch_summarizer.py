@@ -0,0 +1,30 @@
+import os
+
+DEFAULT_BATCH_SIZE = int(os.environ.get("SUMMARY_BATCH_SIZE", 8))
+
+def summarize_batched(summarizer_pipeline, texts, batch_size=DEFAULT_BATCH_SIZE, **generate_kwargs):
+    """Summarizes many texts with a Hugging Face summarization pipeline in padded batches.
+
+    Texts are grouped by length so each batch pads to a similar size, and results come
+    back in input order as dicts with "summary_text" (None on failure) and "error".
+    """
+    results = [None] * len(texts)
+    # Sort by length so each batch is padded to roughly the same number of tokens.
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    for batch_start in range(0, len(order), batch_size):
+        batch_indices = order[batch_start:batch_start + batch_size]
+        batch_texts = [texts[i] for i in batch_indices]
+        try:
+            outputs = summarizer_pipeline(batch_texts, batch_size=len(batch_texts), **generate_kwargs)
+            for i, output in zip(batch_indices, outputs):
+                results[i] = {"summary_text": output["summary_text"].strip(), "error": None}
+        except Exception:
+            # Retry one by one so a single bad input does not fail the whole batch.
+            for i in batch_indices:
+                try:
+                    output = summarizer_pipeline(texts[i], **generate_kwargs)[0]
+                    results[i] = {"summary_text": output["summary_text"].strip(), "error": None}
+                except Exception as item_error:
+                    results[i] = {"summary_text": None, "error": str(item_error)}
+    return results
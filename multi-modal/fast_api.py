@@ -7,8 +7,10 @@ import asyncio
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, Form
 from pydantic import BaseModel
-import requests
+import httpx
 from pyngrok import ngrok
+from backend_client import close_http_client
+from backend_pool import load_backend_pools, NoBackendAvailableError
 
 # 🔐 Ngrok Authentication
 authtoken = input("Please enter your Ngrok authtoken: ").strip()
@@ -25,9 +27,29 @@ print("🔗 Unified FastAPI running on:", public_url)
 COLAB_LLAVA_URL = "https://dd70-34-126-182-181.ngrok-free.app"  # LLaVA (Colab)
 VSCODE_WHISPER_URL = "https://6262-120-56-228-215.ngrok-free.app"                  # Whisper (VSCode)
 
+# 🔌 One load-balanced pool per model type. The URLs above are the defaults; scale out with
+# GATEWAY_BACKENDS_CONFIG (JSON file) or WHISPER_BACKEND_URLS / LLAVA_BACKEND_URLS.
+backend_pools = load_backend_pools({
+    "whisper": {"urls": [VSCODE_WHISPER_URL], "timeout": 900},
+    "llava": {"urls": [COLAB_LLAVA_URL], "timeout": 120},
+})
+whisper_backend = backend_pools["whisper"]
+llava_backend = backend_pools["llava"]
+
 # ⚙️ FastAPI Initialization
 app = FastAPI(title="Unified AI Model API")
 
+@app.on_event("startup")
+async def start_health_checks():
+    for pool in backend_pools.values():
+        pool.start_health_checks()
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    for pool in backend_pools.values():
+        await pool.stop_health_checks()
+    await close_http_client()
+
 @app.get("/")
 def home():
     return {
@@ -35,24 +57,29 @@ def home():
         "ngrok_url": public_url.public_url
     }
 
+@app.get("/backends/")
+def backend_status():
+    return {name: pool.status() for name, pool in backend_pools.items()}
+
 # ✅ Input model for audio
 class YouTubeRequest(BaseModel):
      url: str
 
 # 🎧 Whisper Endpoint via JSON
 @app.post("/analyze/")
-def transcribe_audio(request: YouTubeRequest):
+async def transcribe_audio(request: YouTubeRequest):
     try:
-        whisper_response = requests.post(
-            f"{VSCODE_WHISPER_URL}/analyze/",
-            json={"url": request.url}
-        )
+        whisper_response = await whisper_backend.post("/analyze/", json={"url": request.url})
 
         if whisper_response.status_code == 200:
             return whisper_response.json()
         else:
             return {"error": f"Whisper server responded with {whisper_response.status_code}"}
 
+    except httpx.TimeoutException:
+        return {"error": "Whisper server timed out."}
+    except NoBackendAvailableError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": str(e)}
 
@@ -60,17 +87,13 @@ def transcribe_audio(request: YouTubeRequest):
 @app.post("/predict/")
 async def predict_image(image: UploadFile = File(...), question: str = Form("What is in the image?")):
     try:
-        image_bytes = await image.read()
+        # Stream the spooled upload to the backend instead of reading it into memory first
         files = {
-            'image': (image.filename, image_bytes, image.content_type)
+            'image': (image.filename, image.file, image.content_type)
         }
         data = {'question': question}
 
-        llava_response = requests.post(
-            f"{COLAB_LLAVA_URL}/predict/",
-            files=files,
-            data=data
-        )
+        llava_response = await llava_backend.post("/predict/", files=files, data=data)
 
         if llava_response.headers.get("Content-Type", "").startswith("application/json"):
             return llava_response.json()
@@ -81,6 +104,10 @@ async def predict_image(image: UploadFile = File(...), question: str = Form("Wha
                 "text": llava_response.text
             }
 
+    except httpx.TimeoutException:
+        return {"error": "LLaVA server timed out."}
+    except NoBackendAvailableError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": str(e)}
 
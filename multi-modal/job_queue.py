@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import traceback
+
+DEFAULT_JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+DEFAULT_JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+# Finished ("done"/"failed") jobs kept by the in-memory backend
+DEFAULT_FINISHED_JOB_TTL = float(os.environ.get("JOB_RESULT_TTL_SECONDS", 3600))
+DEFAULT_MAX_FINISHED_JOBS = int(os.environ.get("JOB_MAX_FINISHED", 1000))
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+class InMemoryJobBackend:
+    """Keeps job records in a dict; state is lost when the process exits.
+
+    Finished jobs are dropped `finished_ttl` seconds after they finish, and beyond
+    `max_finished` the oldest finished jobs are dropped first.
+    """
+
+    def __init__(self, finished_ttl=DEFAULT_FINISHED_JOB_TTL, max_finished=DEFAULT_MAX_FINISHED_JOBS):
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._prune()
+            self._jobs[job["id"]] = json.loads(json.dumps(job))
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            stages = fields.pop("stages", None)
+            if stages:
+                job["stages"].update(stages)
+            job.update(fields, updated_at=time.time())
+            self._prune()
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def unfinished(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["status"] in ("queued", "running")]
+
+    def _prune(self):
+        # Caller holds self._lock
+        finished = sorted((job["updated_at"], job_id) for job_id, job in self._jobs.items()
+                          if job["status"] in ("done", "failed"))
+        expire_before = time.time() - self.finished_ttl
+        excess = len(finished) - self.max_finished
+        for i, (updated_at, job_id) in enumerate(finished):
+            if i < excess or updated_at < expire_before:
+                del self._jobs[job_id]
+
+class SQLiteJobBackend:
+    """Persists job records in a SQLite file so status and results survive restarts."""
+
+    def __init__(self, path=os.environ.get("JOB_DB_PATH", "jobs.sqlite3")):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                stages TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def create(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, payload, stages, result, error, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["status"], json.dumps(job["payload"]), json.dumps(job["stages"]),
+                 json.dumps(job["result"]), job["error"], job["created_at"], job["updated_at"]),
+            )
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._get(job_id)
+            stages = fields.pop("stages", None)
+            if stages:
+                job["stages"].update(stages)
+            job.update(fields, updated_at=time.time())
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stages = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (job["status"], json.dumps(job["stages"]), json.dumps(job["result"]), job["error"], job["updated_at"], job_id),
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._get(job_id)
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+            return [self._get(job_id) for (job_id,) in rows]
+
+    def _get(self, job_id):
+        row = self._conn.execute(
+            "SELECT id, status, payload, stages, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "status": row[1], "payload": json.loads(row[2]), "stages": json.loads(row[3]),
+            "result": json.loads(row[4]) if row[4] is not None else None, "error": row[5],
+            "created_at": row[6], "updated_at": row[7],
+        }
+
+class JobQueue:
+    """Bounded job queue drained by a pool of worker threads.
+
+    `runner(payload, progress)` does the work and returns a JSON-serializable result;
+    it reports per-stage progress by calling `progress(stage_name, status)`.
+    Job status moves through "queued" -> "running" -> "done" | "failed".
+    """
+
+    def __init__(self, runner, backend=None, num_workers=DEFAULT_JOB_WORKERS, max_queue_size=DEFAULT_JOB_QUEUE_SIZE):
+        self.runner = runner
+        self.backend = backend if backend is not None else InMemoryJobBackend()
+        self.num_workers = num_workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._workers = []
+
+    def start(self):
+        """Starts the worker threads and re-enqueues jobs a persistent backend left unfinished."""
+        if self._workers:
+            return
+        for job in self.backend.unfinished():
+            try:
+                self._queue.put_nowait(job["id"])
+                self.backend.update(job["id"], status="queued")
+            except queue.Full:
+                self.backend.update(job["id"], status="failed", error="Queue full when resuming after restart.")
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, payload):
+        """Queues a job and returns its ID. Raises QueueFullError when the queue is at capacity."""
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex, "status": "queued", "payload": payload, "stages": {},
+            "result": None, "error": None, "created_at": now, "updated_at": now,
+        }
+        self.backend.create(job)
+        try:
+            self._queue.put_nowait(job["id"])
+        except queue.Full:
+            self.backend.update(job["id"], status="failed", error="Job queue is full.")
+            raise QueueFullError("Job queue is full, try again later.")
+        return job["id"]
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                job = self.backend.get(job_id)
+                if job is None:
+                    continue
+                self.backend.update(job_id, status="running")
+
+                def progress(stage, status):
+                    self.backend.update(job_id, stages={stage: status})
+
+                result = self.runner(job["payload"], progress)
+                self.backend.update(job_id, status="done", result=result)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                traceback.print_exc()
+                self.backend.update(job_id, status="failed", error=str(e))
+            finally:
+                self._queue.task_done()
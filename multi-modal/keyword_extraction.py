@@ -1,6 +1,97 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
 from keybert import KeyBERT
+from sklearn.feature_extraction.text import CountVectorizer
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
+from model_registry import register_model, get_model
+
+KEYBERT_MODEL = "all-MiniLM-L6-v2" # KeyBERT's default embedding model
+register_model("keybert", lambda: KeyBERT(model=KEYBERT_MODEL))
+
+# Long-document mode: the transcript is embedded as overlapping windows (the embedding model
+# truncates long inputs) and the window embeddings are mean-pooled into the document embedding.
+KEYWORD_WINDOW_WORDS = int(os.environ.get("KEYWORD_WINDOW_WORDS", 200))
+KEYWORD_WINDOW_STRIDE = int(os.environ.get("KEYWORD_WINDOW_STRIDE", 150))
+KEYWORD_EMBED_BATCH_SIZE = int(os.environ.get("KEYWORD_EMBED_BATCH_SIZE", 64))
+KEYWORD_MAX_CANDIDATES = int(os.environ.get("KEYWORD_MAX_CANDIDATES", 5000)) # Most frequent n-grams kept as candidates
+KEYWORD_EMBEDDING_CACHE_PATH = os.environ.get("KEYWORD_EMBEDDING_CACHE_PATH", "keyword_embeddings.sqlite3")
+KEYWORD_EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("KEYWORD_EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+
+class PhraseEmbeddingCache:
+    """Persistent n-gram -> embedding cache (SQLite, float32 blobs) with an in-memory LRU in front.
+
+    Entries are keyed by embedding model so switching models never mixes vector spaces.
+    """
+
+    def __init__(self, model_name, path=KEYWORD_EMBEDDING_CACHE_PATH, max_entries=KEYWORD_EMBEDDING_CACHE_MAX_ENTRIES,
+                 memory_entries=100000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS phrase_embeddings (
+                model TEXT NOT NULL,
+                phrase TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (model, phrase)
+            )"""
+        )
+        self._conn.commit()
+
+    def get_many(self, phrases):
+        """Returns {phrase: embedding} for the phrases that are cached."""
+        found = {}
+        with self._lock:
+            missing = []
+            for phrase in phrases:
+                if phrase in self._memory:
+                    self._memory.move_to_end(phrase)
+                    found[phrase] = self._memory[phrase]
+                else:
+                    missing.append(phrase)
+            for start in range(0, len(missing), 500): # Stay under SQLite's bound-parameter limit
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT phrase, embedding FROM phrase_embeddings WHERE model = ? AND phrase IN ({','.join('?' * len(chunk))})",
+                    [self.model_name, *chunk],
+                ).fetchall()
+                for phrase, blob in rows:
+                    found[phrase] = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(phrase, found[phrase])
+        return found
+
+    def put_many(self, embeddings):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO phrase_embeddings (model, phrase, embedding) VALUES (?, ?, ?)",
+                [(self.model_name, phrase, np.asarray(embedding, dtype=np.float32).tobytes())
+                 for phrase, embedding in embeddings.items()],
+            )
+            for phrase, embedding in embeddings.items():
+                self._remember(phrase, np.asarray(embedding, dtype=np.float32))
+            # Drop the oldest rows beyond the bound
+            self._conn.execute(
+                "DELETE FROM phrase_embeddings WHERE rowid IN (SELECT rowid FROM phrase_embeddings ORDER BY rowid LIMIT "
+                "MAX(0, (SELECT COUNT(*) FROM phrase_embeddings) - ?))",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def _remember(self, phrase, embedding):
+        # Caller holds self._lock
+        self._memory[phrase] = embedding
+        self._memory.move_to_end(phrase)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+_phrase_cache = None
 
 _lemmatizer_kw = None # Module-level variable for lemmatizer instance
 
@@ -14,28 +105,110 @@ def lemmatize_text_for_keywords(text_to_lemmatize):
     lemmatized_text = ' '.join([_lemmatizer_kw.lemmatize(token) for token in tokens])
     return lemmatized_text
 
-def extract_keywords_local(text_for_keywords, num_keywords=10):
-    """Extracts keywords using KeyBERT."""
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def _embed_batched(backend, texts, batch_size=KEYWORD_EMBED_BATCH_SIZE):
+    return np.vstack([backend.embed(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)])
+
+def maximal_marginal_relevance(doc_embedding, candidate_embeddings, candidates, top_n, diversity):
+    """MMR over unit-normalized embeddings; returns [(candidate, similarity to the document)], best first.
+
+    Each step scores every remaining candidate at once against the running max similarity
+    to the already selected ones.
+    """
+    relevance = candidate_embeddings @ doc_embedding
+    selected = [int(np.argmax(relevance))]
+    max_redundancy = candidate_embeddings @ candidate_embeddings[selected[0]]
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(top_n, len(candidates)) - 1):
+        scores = (1 - diversity) * relevance - diversity * max_redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_redundancy = np.maximum(max_redundancy, candidate_embeddings @ candidate_embeddings[best])
+    # Highest similarity first, as KeyBERT returns them
+    return sorted(((candidates[i], round(float(relevance[i]), 4)) for i in selected), key=lambda kw: kw[1], reverse=True)
+
+def extract_keywords_long_document(kw_model, document, top_n=10, keyphrase_ngram_range=(1, 2), stop_words='english',
+                                   diversity=0.7, window_words=KEYWORD_WINDOW_WORDS, stride_words=KEYWORD_WINDOW_STRIDE):
+    """KeyBERT-style keyphrase extraction for documents longer than the embedding model's input.
+
+    The document embedding is the mean of overlapping window embeddings (computed in batches);
+    candidate n-gram embeddings come from the persistent phrase cache, encoding only new phrases.
+    Returns [(keyword, score)] like KeyBERT.extract_keywords.
+    """
+    global _phrase_cache
+    if _phrase_cache is None:
+        _phrase_cache = PhraseEmbeddingCache(KEYBERT_MODEL)
+
+    vectorizer = CountVectorizer(ngram_range=keyphrase_ngram_range, stop_words=stop_words)
+    counts = np.asarray(vectorizer.fit_transform([document]).sum(axis=0)).ravel()
+    vocabulary = vectorizer.get_feature_names_out()
+    candidates = [vocabulary[i] for i in np.argsort(-counts, kind="stable")[:KEYWORD_MAX_CANDIDATES]]
+    if not candidates:
+        return []
+
+    words = document.split()
+    windows = [" ".join(words[start:start + window_words])
+               for start in range(0, max(1, len(words) - window_words + stride_words), stride_words)]
+    window_embeddings = _normalize_rows(_embed_batched(kw_model.model, windows))
+    doc_embedding = _normalize_rows(window_embeddings.mean(axis=0))
+
+    cached = _phrase_cache.get_many(candidates)
+    new_phrases = [phrase for phrase in candidates if phrase not in cached]
+    if new_phrases:
+        new_embeddings = _embed_batched(kw_model.model, new_phrases)
+        encoded = dict(zip(new_phrases, new_embeddings))
+        _phrase_cache.put_many(encoded)
+        cached.update(encoded)
+    print(f"Embedded {len(windows)} windows; {len(candidates) - len(new_phrases)}/{len(candidates)} candidate embeddings cached.")
+    candidate_embeddings = _normalize_rows(np.vstack([cached[phrase] for phrase in candidates]))
+    return maximal_marginal_relevance(doc_embedding, candidate_embeddings, candidates, top_n, diversity)
+
+def extract_keywords_local(text_for_keywords, num_keywords=10, long_document=None, raise_errors=False):
+    """Extracts keywords using KeyBERT.
+
+    `long_document` selects the windowed long-document mode; by default it is used when the
+    transcript is longer than one window (KEYWORD_WINDOW_WORDS words).
+    With `raise_errors`, failures are raised instead of returning [] (so callers don't cache them).
+    """
     if not text_for_keywords or not text_for_keywords.strip():
         print("No text provided for keyword extraction.")
         return []
 
     print("\n--- Keyword Extraction ---")
-    print("Loading KeyBERT model for keyword extraction...")
+    print("Getting KeyBERT model for keyword extraction...")
     try:
-        kw_model = KeyBERT() # Loads default KeyBERT model
+        kw_model = get_model("keybert")
         
         # Lemmatization can sometimes help KeyBERT by reducing words to their base form
         lemmatized_transcription = lemmatize_text_for_keywords(text_for_keywords)
         
-        keywords_with_scores = kw_model.extract_keywords(
-            lemmatized_transcription,
-            keyphrase_ngram_range=(1, 2), # Extract 1-word and 2-word phrases
-            stop_words='english',         # Use built-in English stop words
-            top_n=num_keywords,
-            use_mmr=True,                 # Use Maximal Marginal Relevance for diverse keywords
-            diversity=0.7                 # Diversity parameter for MMR (0 to 1, higher means more diverse)
-        )
+        if long_document is None:
+            long_document = len(lemmatized_transcription.split()) > KEYWORD_WINDOW_WORDS
+
+        if long_document:
+            keywords_with_scores = extract_keywords_long_document(
+                kw_model,
+                lemmatized_transcription,
+                top_n=num_keywords,
+                keyphrase_ngram_range=(1, 2),
+                stop_words='english',
+                diversity=0.7
+            )
+        else:
+            keywords_with_scores = kw_model.extract_keywords(
+                lemmatized_transcription,
+                keyphrase_ngram_range=(1, 2), # Extract 1-word and 2-word phrases
+                stop_words='english',         # Use built-in English stop words
+                top_n=num_keywords,
+                use_mmr=True,                 # Use Maximal Marginal Relevance for diverse keywords
+                diversity=0.7                 # Diversity parameter for MMR (0 to 1, higher means more diverse)
+            )
         print(f"Top {num_keywords} Keywords/Keyphrases (after lemmatization):")
         if keywords_with_scores:
             for keyword, score in keywords_with_scores:
@@ -45,4 +218,6 @@ def extract_keywords_local(text_for_keywords, num_keywords=10):
         return keywords_with_scores
     except Exception as e:
         print(f"Error during keyword extraction: {e}")
+        if raise_errors:
+            raise
         return []
\ No newline at end of file
@@ -3,18 +3,26 @@
 
 
 import os
-import torch
-import whisper
-from fastapi import FastAPI, Request
+import json
+import uuid
+import threading
+from typing import List, Optional
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from transformers import pipeline as hf_pipeline
 from setup import setup_nltk_resources, suppress_warnings_function
 from download_audio import download_audio_from_youtube_local
 from summarize_text import summarize_text_local
-from ner import perform_ner_local
-from keyword_extraction import extract_keywords_local
-from topic_modeling import perform_topic_modeling_local
+from batch_summarizer import summarize_batched
+from ner import perform_ner_detailed, unique_entities
+from keyword_extraction import extract_keywords_local, KEYWORD_WINDOW_WORDS, KEYWORD_WINDOW_STRIDE
+from topic_modeling import perform_topic_modeling_local, TOPIC_MODEL_ENGINE
+from transcribe_audio import transcribe_audio_streaming
+from model_registry import get_model, warm_up_models
+from stage_executor import Stage, run_stages
+from job_queue import JobQueue, InMemoryJobBackend, SQLiteJobBackend, QueueFullError
+from result_cache import ResultCache, normalize_url, hash_file, hash_text, stage_key
 
 import nest_asyncio
 import uvicorn
@@ -33,10 +41,19 @@ app.add_middleware(
 # Setup FFMPEG path
 os.environ["PATH"] += os.pathsep + r"D:\Downloads\ffmpeg-7.0.2-essentials_build\ffmpeg-7.0.2-essentials_build\bin"
 
-# Load Whisper and Summarizer once
-device = "cuda" if torch.cuda.is_available() else "cpu"
-whisper_model = whisper.load_model("base").to(device)
-summarizer = hf_pipeline("summarization", model="t5-small", device=0 if torch.cuda.is_available() else -1)
+# Models are loaded once per process through the shared registry.
+# WARMUP_MODELS is a comma-separated list of registry names ("all" loads every registered model).
+WARMUP_MODELS = os.environ.get("WARMUP_MODELS", "whisper-base,t5-small-summarizer")
+
+@app.on_event("startup")
+def warm_up():
+    if WARMUP_MODELS.strip().lower() == "all":
+        warm_up_models()
+    elif WARMUP_MODELS.strip():
+        warm_up_models([name.strip() for name in WARMUP_MODELS.split(",") if name.strip()])
+
+# Persistent cache of transcripts and stage outputs (see result_cache.py for the key layout)
+result_cache = ResultCache()
 
 # Helper for timestamp formatting
 def format_timestamp(seconds):
@@ -47,9 +64,86 @@ def format_timestamp(seconds):
 # Request body structure
 class YouTubeURL(BaseModel):
     url: str
+    stages: Optional[List[str]] = None  # Subset of STAGE_RESPONSE_KEYS to run; all stages when omitted
+    stage_timeout: Optional[float] = None  # Per-stage timeout in seconds (defaults to STAGE_TIMEOUT_SECONDS)
+
+# Analysis stage name -> key of its output in the /analyze/ response
+STAGE_RESPONSE_KEYS = {
+    "chapters": "chapter_summary",
+    "summary": "summary",
+    "entities": "entities",
+    "entity_mentions": "entity_mentions",
+    "keywords": "keywords",
+    "topics": "topics",
+}
+
+def load_transcript(youtube_url):
+    """Returns Whisper segments for a URL, reusing cached transcripts by URL and by audio hash."""
+    url_key = normalize_url(youtube_url)
+    audio_hash = result_cache.get("url", url_key)
+    if audio_hash:
+        cached = result_cache.get("transcript", audio_hash)
+        if cached is not None:
+            return cached["segments"]
+
+    # Unique per call so concurrent jobs never share a download path.
+    temp_audio = f"temp_podcast_processing_audio_{uuid.uuid4().hex}"
+    audio_path = None
+    try:
+        audio_path = download_audio_from_youtube_local(youtube_url, temp_audio)
+        if not audio_path:
+            return None
 
-@app.post("/analyze/")
-def analyze_youtube_podcast(data: YouTubeURL):
+        # Different URLs (mirrors, re-uploads) can carry identical audio.
+        audio_hash = hash_file(audio_path)
+        result_cache.set("url", url_key, audio_hash)
+        cached = result_cache.get("transcript", audio_hash)
+        if cached is not None:
+            return cached["segments"]
+
+        whisper_model = get_model("whisper-base")
+        result = whisper_model.transcribe(audio_path, verbose=False)
+        segments = [
+            {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+            for seg in result.get("segments", [])
+        ]
+        result_cache.set("transcript", audio_hash, {"language": result.get("language"), "segments": segments})
+        return segments
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+def summarize_chapters(segments):
+    """Builds one numbered, timestamped summary line per minute of transcript.
+
+    Returns (chapter summary, errors). A chapter whose block fails to summarize gets its error
+    on its line instead of a summary, and an entry {"chapter", "timestamp", "error"} in errors.
+    """
+    summarizer = get_model("t5-small-summarizer")
+    chapter_map = {}
+    for seg in segments:
+        minute = int(seg["start"] // 60)
+        chapter_map.setdefault(minute, []).append(seg["text"].strip())
+
+    minutes = sorted(chapter_map.keys())
+    block_texts = [" ".join(chapter_map[minute]) for minute in minutes]
+    block_summaries = summarize_batched(summarizer, block_texts, max_length=25, min_length=8, do_sample=False, truncation=True)
+
+    chapters = []
+    errors = []
+    for idx, (minute, result) in enumerate(zip(minutes, block_summaries)):
+        timestamp = format_timestamp(minute * 60)
+        if result["error"] is not None:
+            errors.append({"chapter": idx+1, "timestamp": timestamp, "error": result["error"]})
+            summary = f"[Summary failed: {result['error']}]"
+        else:
+            summary = result["summary_text"]
+        chapters.append(f"{idx+1}. {summary} ({timestamp})")
+    return "\n".join(chapters), errors
+
+def run_analysis(data, progress=None):
+    """Runs the full podcast analysis for a request. `progress(stage, status)` receives per-stage updates."""
+    progress = progress or (lambda stage, status: None)
     youtube_url = data.url.strip()
     setup_nltk_resources()
     suppress_warnings_function()
@@ -57,54 +151,171 @@ def analyze_youtube_podcast(data: YouTubeURL):
     if not youtube_url:
         return {"error": "❌ Please provide a YouTube URL."}
 
-    temp_audio = "temp_podcast_processing_audio"
-    audio_path = None
-
     try:
-        # Step 1: Download audio
-        audio_path = download_audio_from_youtube_local(youtube_url, temp_audio)
-        if not audio_path:
+        # Step 1: Download and transcribe audio (cached by URL and audio hash)
+        progress("transcribe", "running")
+        segments = load_transcript(youtube_url)
+        if segments is None:
+            progress("transcribe", "error")
             return {"error": "❌ Failed to download audio."}
+        progress("transcribe", "ok")
 
-        # Step 2: Transcribe and summarize
-        result = whisper_model.transcribe(audio_path, verbose=False)
-        segments = result.get("segments", [])
         full_text = ""
-        chapter_map = {}
-
         for seg in segments:
-            minute = int(seg["start"] // 60)
-            chapter_map.setdefault(minute, []).append(seg["text"].strip())
             full_text += seg["text"].strip() + " "
-
-        chapters = []
-        for idx, minute in enumerate(sorted(chapter_map.keys())):
-            block_text = " ".join(chapter_map[minute])
-            timestamp = format_timestamp(minute * 60)
-            try:
-                summary = summarizer(block_text, max_length=25, min_length=8, do_sample=False)[0]['summary_text'].strip()
-            except:
-                summary = block_text[:80] + "..."
-            chapters.append(f"{idx+1}. {summary} ({timestamp})")
-
-        # Step 3: Additional NLP tasks (optional)
-        _ = summarize_text_local(full_text, target_words=150)
-        _ = perform_ner_local(full_text)
-        _ = extract_keywords_local(full_text, num_keywords=10)
-        _ = perform_topic_modeling_local(full_text, num_topics=5, num_words_per_topic=5)
-
-        return {
-            "full_transcript": full_text.strip(),
-            "chapter_summary": "\n".join(chapters)
+        transcript_hash = hash_text(full_text)
+
+        # "entities" and "entity_mentions" share one NER run (with segment timestamps)
+        ner_lock = threading.Lock()
+        ner_result = {}
+
+        def ner_mentions():
+            with ner_lock:
+                if "mentions" not in ner_result:
+                    print("\n--- Named Entity Recognition ---")
+                    ner_result["mentions"] = perform_ner_detailed(full_text, segments)
+                return ner_result["mentions"]
+
+        # Chapters that fail to summarize are reported in place; such a partial result is not cached
+        chapter_errors = []
+
+        def chapter_summary():
+            text, errors = summarize_chapters(segments)
+            chapter_errors.extend(errors)
+            return text
+
+        # Step 2: Chapter summaries and NLP stages, run concurrently on the shared transcript.
+        # Each stage is (cache parameters, compute function); outputs are cached per stage.
+        # Compute functions raise on failure, so fallbacks never end up in the cache.
+        stage_specs = {
+            "chapters": ({"model": "t5-small", "max_length": 25, "min_length": 8},
+                         chapter_summary),
+            "summary": ({"target_words": 150},
+                        lambda: summarize_text_local(full_text, target_words=150, raise_errors=True)),
+            "entities": ({},
+                         lambda: unique_entities(ner_mentions())),
+            "entity_mentions": ({},
+                                lambda: ner_mentions()),
+            "keywords": ({"num_keywords": 10, "window_words": KEYWORD_WINDOW_WORDS, "window_stride": KEYWORD_WINDOW_STRIDE},
+                         lambda: extract_keywords_local(full_text, num_keywords=10, raise_errors=True)),
+            "topics": ({"num_topics": 5, "num_words_per_topic": 5, "engine": TOPIC_MODEL_ENGINE},
+                       lambda: perform_topic_modeling_local(full_text, num_topics=5, num_words_per_topic=5, raise_errors=True)),
+        }
+        requested = data.stages if data.stages is not None else list(stage_specs)
+        unknown = [name for name in requested if name not in stage_specs]
+        if unknown:
+            return {"error": f"❌ Unknown stage(s): {', '.join(unknown)}. Choose from: {', '.join(stage_specs)}"}
+
+        def make_stage(name):
+            params, compute = stage_specs[name]
+            key = stage_key(transcript_hash, name, params)
+            should_cache = (lambda _summary: not chapter_errors) if name == "chapters" else None
+            return Stage(name, lambda _inputs: result_cache.get_or_compute("stage", key, compute, should_cache=should_cache),
+                         timeout=data.stage_timeout)
+
+        for name in requested:
+            progress(name, "queued")
+        outcomes = run_stages([make_stage(name) for name in requested],
+                              on_stage_done=lambda name, outcome: progress(name, outcome["status"]))
+
+        response = {"full_transcript": full_text.strip()}
+        for name, outcome in outcomes.items():
+            response[STAGE_RESPONSE_KEYS[name]] = outcome["result"]
+        if "chapters" in outcomes:
+            response["chapter_errors"] = chapter_errors
+        response["stages"] = {
+            name: {"status": outcome["status"], "seconds": round(outcome["seconds"], 3), "error": outcome["error"]}
+            for name, outcome in outcomes.items()
         }
+        return response
 
     except Exception as e:
         import traceback
         return {"error": str(e), "trace": traceback.format_exc()}
 
-    finally:
-        if audio_path and os.path.exists(audio_path):
-            os.remove(audio_path)
+@app.post("/analyze/")
+def analyze_youtube_podcast(data: YouTubeURL):
+    return run_analysis(data)
+
+def run_analysis_job(payload, progress):
+    result = run_analysis(YouTubeURL(**payload), progress)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+# Background analysis jobs. JOB_BACKEND selects "memory" (default) or "sqlite" (JOB_DB_PATH).
+job_backend = SQLiteJobBackend() if os.environ.get("JOB_BACKEND", "memory") == "sqlite" else InMemoryJobBackend()
+job_queue = JobQueue(run_analysis_job, backend=job_backend)
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.post("/jobs", status_code=202)
+def submit_analysis_job(data: YouTubeURL):
+    """Queues an analysis and returns its job ID immediately."""
+    if not data.url.strip():
+        raise HTTPException(status_code=400, detail="Please provide a YouTube URL.")
+    try:
+        job_id = job_queue.submit(data.dict())
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_analysis_job(job_id: str):
+    """Reports a job's overall status and per-stage progress."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stages": job["stages"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.get("/jobs/{job_id}/result")
+def get_analysis_job_result(job_id: str):
+    """Returns the analysis result once the job is done."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+    return job["result"]
+
+@app.post("/analyze/stream/")
+def analyze_youtube_podcast_stream(data: YouTubeURL):
+    """Streams transcript segments as NDJSON lines while the audio is still being decoded."""
+    youtube_url = data.url.strip()
+    if not youtube_url:
+        return {"error": "❌ Please provide a YouTube URL."}
+
+    def event_stream():
+        audio_path = None
+        try:
+            audio_path = download_audio_from_youtube_local(youtube_url, f"temp_podcast_stream_audio_{uuid.uuid4().hex}")
+            if not audio_path:
+                yield json.dumps({"type": "error", "error": "❌ Failed to download audio."}) + "\n"
+                return
+
+            full_text = ""
+            for segment in transcribe_audio_streaming(audio_path):
+                full_text += segment["text"] + " "
+                yield json.dumps({"type": "segment", "timestamp": format_timestamp(segment["start"]), **segment}) + "\n"
+            yield json.dumps({"type": "done", "full_transcript": full_text.strip()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+        finally:
+            if audio_path and os.path.exists(audio_path):
+                os.remove(audio_path)
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
 
 @app.get("/")
 def home():
@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+def _parse_max_bytes(value):
+    """Parses a memory budget such as '4096', '512MB' or '6GB' into bytes (0 means unlimited)."""
+    if not value:
+        return 0
+    value = value.strip().upper()
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+    for suffix, multiplier in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * multiplier)
+    return int(value)
+
+def _estimate_model_bytes(model):
+    """Best-effort estimate of the memory held by a loaded model's parameters."""
+    # Whisper models are torch modules, HF pipelines keep theirs on `.model`,
+    # KeyBERT wraps a SentenceTransformer on `.model.embedding_model`.
+    candidates = [
+        model,
+        getattr(model, "model", None),
+        getattr(getattr(model, "model", None), "embedding_model", None),
+    ]
+    for candidate in candidates:
+        parameters = getattr(candidate, "parameters", None)
+        if callable(parameters):
+            try:
+                return sum(p.numel() * p.element_size() for p in parameters())
+            except Exception:
+                continue
+    return 0
+
+class ModelRegistry:
+    """Thread-safe registry that loads each model once, on first use, and evicts the least recently used ones when over budget."""
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._loaders = {}
+        self._size_hints = {}
+        self._models = OrderedDict()  # name -> (model, size_in_bytes), oldest first
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader, size_hint=None):
+        """Registers a zero-argument loader for `name`. Re-registering replaces the loader."""
+        with self._lock:
+            self._loaders[name] = loader
+            if size_hint is not None:
+                self._size_hints[name] = size_hint
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Returns the model registered as `name`, loading it on first use."""
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name][0]
+            if name not in self._loaders:
+                raise KeyError(f"No model registered under '{name}'.")
+            load_lock = self._load_locks[name]
+
+        # Load outside the registry lock so different models can load concurrently,
+        # while concurrent requests for the same model wait for a single load.
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+                loader = self._loaders[name]
+
+            print(f"[ModelRegistry] Loading '{name}'...")
+            model = loader()
+            size = _estimate_model_bytes(model) or self._size_hints.get(name, 0)
+
+            with self._lock:
+                self._models[name] = (model, size)
+                self._evict_over_budget(keep=name)
+            print(f"[ModelRegistry] '{name}' ready ({size / 1024 ** 2:.0f} MB).")
+            return model
+
+    def warm_up(self, names=None):
+        """Eagerly loads the given models (all registered models when `names` is None)."""
+        if names is None:
+            with self._lock:
+                names = list(self._loaders)
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"[ModelRegistry] Warm-up of '{name}' failed: {e}")
+
+    def evict(self, name):
+        """Drops a loaded model so its memory can be reclaimed. Returns True if it was loaded."""
+        with self._lock:
+            evicted = self._models.pop(name, None) is not None
+        if evicted:
+            self._release_memory()
+        return evicted
+
+    def loaded(self):
+        """Returns {name: size_in_bytes} for currently loaded models, least recently used first."""
+        with self._lock:
+            return {name: size for name, (_, size) in self._models.items()}
+
+    def _evict_over_budget(self, keep):
+        # Caller holds self._lock.
+        if not self.max_bytes:
+            return
+        evicted = []
+        total = sum(size for _, size in self._models.values())
+        for name in list(self._models):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            _, size = self._models.pop(name)
+            total -= size
+            evicted.append(name)
+        if evicted:
+            print(f"[ModelRegistry] Evicted {', '.join(evicted)} to stay within the memory budget.")
+            self._release_memory()
+
+    @staticmethod
+    def _release_memory():
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+# Process-wide registry shared by all stage modules.
+registry = ModelRegistry(max_bytes=_parse_max_bytes(os.environ.get("MODEL_REGISTRY_MAX_BYTES")))
+
+def register_model(name, loader, size_hint=None):
+    """Registers a loader on the shared registry."""
+    registry.register(name, loader, size_hint=size_hint)
+
+def get_model(name):
+    """Returns a model from the shared registry, loading it on first use."""
+    return registry.get(name)
+
+def warm_up_models(names=None):
+    """Eagerly loads models on the shared registry."""
+    registry.warm_up(names)
@@ -1,29 +1,118 @@
+import os
+import re
+import bisect
 import spacy
+from model_registry import register_model, get_model
+
+# Only doc.ents is used, so skip the components NER doesn't need. A spaCy pipeline has no
+# torch parameters to measure, so its approximate resident size is given up front.
+register_model("spacy-en_core_web_sm",
+               lambda: spacy.load("en_core_web_sm", exclude=["parser", "tagger", "lemmatizer", "attribute_ruler"]),
+               size_hint=50 * 1024 ** 2)
+
+# Transcripts are split into pieces (paragraphs, then groups of whole sentences) that are
+# streamed through nlp.pipe, which keeps each piece far below spaCy's max_length.
+NER_PIECE_MAX_CHARS = int(os.environ.get("NER_PIECE_MAX_CHARS", 5000))
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", 32))
+NER_N_PROCESS = int(os.environ.get("NER_N_PROCESS", 1))
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_text_for_ner(text, max_chars=NER_PIECE_MAX_CHARS):
+    """Yields (piece, start offset in text). Pieces never cross a paragraph break and only split
+    between sentences, unless a single sentence is longer than `max_chars`."""
+    paragraph_start = 0
+    for paragraph_break in list(_PARAGRAPH_BREAK.finditer(text)) + [None]:
+        paragraph_end = paragraph_break.start() if paragraph_break else len(text)
+        piece_start = paragraph_start
+        sentence_start = paragraph_start
+        for sentence_break in list(_SENTENCE_END.finditer(text, paragraph_start, paragraph_end)) + [None]:
+            sentence_end = sentence_break.start() if sentence_break else paragraph_end
+            if sentence_end - piece_start > max_chars and sentence_start > piece_start:
+                yield text[piece_start:sentence_start], piece_start
+                piece_start = sentence_start
+            while sentence_end - piece_start > max_chars:
+                yield text[piece_start:piece_start + max_chars], piece_start
+                piece_start += max_chars
+            sentence_start = sentence_break.end() if sentence_break else paragraph_end
+        if text[piece_start:paragraph_end].strip():
+            yield text[piece_start:paragraph_end], piece_start
+        paragraph_start = paragraph_break.end() if paragraph_break else len(text)
+
+def _segment_spans(text, segments):
+    """Locates each Whisper segment's text in the transcript; returns sorted (start_char, end_char, segment)."""
+    spans = []
+    cursor = 0
+    for segment in segments:
+        segment_text = segment["text"].strip()
+        if not segment_text:
+            continue
+        start_char = text.find(segment_text, cursor)
+        if start_char == -1:
+            continue
+        cursor = start_char + len(segment_text)
+        spans.append((start_char, cursor, segment))
+    return spans
+
+def perform_ner_detailed(text_for_ner, segments=None, batch_size=NER_BATCH_SIZE, n_process=NER_N_PROCESS):
+    """Performs NER and returns every mention as {"text", "label", "start_char", "end_char"}.
+
+    Offsets refer to `text_for_ner`. When the Whisper `segments` the transcript was built from
+    are given, mentions also get the "start"/"end" times (seconds) of the segments they fall in.
+    """
+    if not text_for_ner or not text_for_ner.strip():
+        return []
+    nlp = get_model("spacy-en_core_web_sm")
+
+    mentions = []
+    pieces = split_text_for_ner(text_for_ner)
+    for doc, offset in nlp.pipe(pieces, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        for entity in doc.ents:
+            mentions.append({
+                "text": entity.text,
+                "label": entity.label_,
+                "start_char": offset + entity.start_char,
+                "end_char": offset + entity.end_char,
+            })
+
+    if segments:
+        spans = _segment_spans(text_for_ner, segments)
+        span_starts = [start_char for start_char, _, _ in spans]
+        for mention in mentions:
+            first = bisect.bisect_right(span_starts, mention["start_char"]) - 1
+            last = bisect.bisect_right(span_starts, mention["end_char"] - 1) - 1
+            if first >= 0 and last >= 0:
+                mention["start"] = spans[first][2]["start"]
+                mention["end"] = spans[last][2]["end"]
+    return mentions
+
+def unique_entities(mentions):
+    """Unique (text, label) pairs, sorted, as perform_ner_local returns them."""
+    return sorted(set((mention["text"], mention["label"]) for mention in mentions))
 
 def perform_ner_local(text_for_ner):
     """Performs NER using SpaCy."""
     if not text_for_ner or not text_for_ner.strip():
         print("No text provided for NER.")
         return []
-        
+
     print("\n--- Named Entity Recognition ---")
-    print("Loading SpaCy model (en_core_web_sm) for NER...")
+    print("Getting SpaCy model (en_core_web_sm) for NER...")
     try:
-        nlp = spacy.load("en_core_web_sm")
+        mentions = perform_ner_detailed(text_for_ner)
     except OSError:
         print("Spacy 'en_core_web_sm' model not found. Please run:")
         print("python -m spacy download en_core_web_sm")
         return []
-        
-    doc = nlp(text_for_ner)
-    entities = [(entity.text, entity.label_) for entity in doc.ents]
+
     # Use a set to get unique entity-label pairs, then convert back to list and sort
-    unique_entities = sorted(list(set(entities))) 
+    unique = unique_entities(mentions)
 
     print("Extracted Entities:")
-    if unique_entities:
-        for entity_text, entity_label in unique_entities:
+    if unique:
+        for entity_text, entity_label in unique:
             print(f"  Entity: {entity_text}, Label: {entity_label}")
     else:
         print("  No entities found.")
-    return unique_entities
\ No newline at end of file
+    return unique
@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+
+# Namespaces used by the /analyze/ pipeline:
+#   "url"        normalized URL -> audio hash
+#   "transcript" audio hash -> transcript and segments
+#   "stage"      transcript hash + stage parameters -> that stage's output
+DEFAULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "analysis_cache.sqlite3")
+DEFAULT_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 1024 ** 3))
+DEFAULT_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+_YOUTUBE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def normalize_url(url):
+    """Reduces YouTube URL variants (watch, youtu.be, shorts, extra params) to 'youtube:<video id>'."""
+    url = url.strip()
+    parsed = urlparse(url if "://" in url else "https://" + url)
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.")
+
+    video_id = None
+    if host == "youtu.be":
+        video_id = parsed.path.strip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        if parsed.path == "/watch":
+            video_id = parse_qs(parsed.query).get("v", [None])[0]
+        elif parsed.path.startswith(("/shorts/", "/embed/", "/live/")):
+            video_id = parsed.path.split("/")[2]
+
+    if video_id and _YOUTUBE_ID_PATTERN.match(video_id):
+        return f"youtube:{video_id}"
+    return f"{host}{parsed.path.rstrip('/')}?{parsed.query}" if parsed.query else f"{host}{parsed.path.rstrip('/')}"
+
+def hash_file(path, block_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_text(text):
+    """Returns the SHA-256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def stage_key(transcript_hash, stage, params):
+    """Builds the cache key for one stage's output from the transcript hash and the stage parameters."""
+    return f"{transcript_hash}:{stage}:{json.dumps(params, sort_keys=True)}"
+
+class ResultCache:
+    """Persistent SQLite-backed key/value cache with per-entry TTLs and a total size bound (LRU eviction)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._conn.commit()
+
+    def get(self, namespace, key):
+        """Returns the cached value, or None when missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None):
+        """Stores a JSON-serializable value. `ttl` in seconds overrides the default (0 = never expires)."""
+        ttl = self.default_ttl if ttl is None else ttl
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, len(payload), now + ttl if ttl else None, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def get_or_compute(self, namespace, key, compute, ttl=None, should_cache=None):
+        """Returns the cached value for `key`, computing and storing it on a miss.
+
+        `compute` should raise on failure: whatever it returns (other than None) is cached for the full TTL,
+        unless `should_cache(value)` returns False (e.g. for a partial result).
+        """
+        value = self.get(namespace, key)
+        if value is None:
+            value = compute()
+            if value is not None and (should_cache is None or should_cache(value)):
+                self.set(namespace, key, value, ttl=ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Caller holds self._lock. Drop expired entries first, then least recently used ones.
+        self._conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT namespace, key, size FROM entries ORDER BY last_access ASC").fetchall()
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
@@ -0,0 +1,102 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_STAGE_TIMEOUT = float(os.environ.get("STAGE_TIMEOUT_SECONDS", 300))
+DEFAULT_MAX_WORKERS = int(os.environ.get("STAGE_MAX_WORKERS", 4))
+
+class Stage:
+    """One node of the analysis DAG.
+
+    `func` is called with a dict holding the results of the stages listed in `depends_on`.
+    """
+
+    def __init__(self, name, func, depends_on=(), timeout=None):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+
+def _timed(func, started):
+    """Wraps `func` so `started` gets its start time once a worker actually runs it."""
+    def run(inputs):
+        started.set_result(time.monotonic())
+        return func(inputs)
+    return run
+
+def run_stages(stages, max_workers=DEFAULT_MAX_WORKERS, default_timeout=DEFAULT_STAGE_TIMEOUT, on_stage_done=None):
+    """Runs independent stages concurrently on a thread pool, respecting dependencies.
+
+    Returns {stage name: {"status", "result", "error", "seconds"}} where status is one of
+    "ok", "error", "timeout" or "skipped" (a dependency did not finish with "ok").
+    Threads are used rather than processes so stages share the models already loaded in
+    the process-wide registry; the heavy lifting happens in torch/spaCy/gensim code
+    that releases the GIL. A stage's timeout and "seconds" count from when a worker starts
+    running it, not from when it was queued. A timed-out stage is reported immediately but its thread is
+    left to finish in the background, since Python threads cannot be cancelled.
+    `on_stage_done(name, outcome)` is called as each stage finishes.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.depends_on if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {', '.join(missing)}")
+
+    outcomes = {}
+    pending = dict(by_name)
+    running = {}  # future -> (stage, Future resolved with the time the stage started running)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+
+    def finish(name, outcome):
+        outcomes[name] = outcome
+        if on_stage_done is not None:
+            on_stage_done(name, outcome)
+
+    try:
+        while pending or running:
+            # Submit every stage whose dependencies have all completed; skip those with failed dependencies.
+            for name, stage in list(pending.items()):
+                if not all(dep in outcomes for dep in stage.depends_on):
+                    continue
+                del pending[name]
+                failed = [dep for dep in stage.depends_on if outcomes[dep]["status"] != "ok"]
+                if failed:
+                    finish(name, {"status": "skipped", "result": None,
+                                  "error": f"Dependency failed: {', '.join(failed)}", "seconds": 0.0})
+                    continue
+                inputs = {dep: outcomes[dep]["result"] for dep in stage.depends_on}
+                started = Future()
+                running[executor.submit(_timed(stage.func, started), inputs)] = (stage, started)
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among stages: {', '.join(pending)}")
+                break
+
+            # Wake when a stage finishes, a queued stage starts (its deadline begins) or a deadline passes.
+            now = time.monotonic()
+            deadlines = [started.result() + (stage.timeout or default_timeout)
+                         for stage, started in running.values() if started.done()]
+            queued = [started for _, started in running.values() if not started.done()]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            done, _ = wait(list(running) + queued, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for future, (stage, started) in list(running.items()):
+                if not started.done():
+                    continue
+                elapsed = now - started.result()
+                if future in done:
+                    del running[future]
+                    try:
+                        finish(stage.name, {"status": "ok", "result": future.result(), "error": None, "seconds": elapsed})
+                    except Exception as e:
+                        finish(stage.name, {"status": "error", "result": None, "error": str(e), "seconds": elapsed})
+                elif elapsed >= (stage.timeout or default_timeout):
+                    del running[future]
+                    future.cancel()
+                    finish(stage.name, {"status": "timeout", "result": None,
+                                        "error": f"Stage exceeded {stage.timeout or default_timeout:g}s", "seconds": elapsed})
+    finally:
+        executor.shutdown(wait=False)
+    return outcomes
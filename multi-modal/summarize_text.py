@@ -2,23 +2,39 @@ import os
 import torch
 from transformers import pipeline as hf_pipeline
 from nltk.tokenize import sent_tokenize, word_tokenize
+from model_registry import register_model, get_model
+from batch_summarizer import summarize_batched, DEFAULT_BATCH_SIZE
+
+def _load_bart_summarizer():
+    device_id = 0 if torch.cuda.is_available() else -1
+    return hf_pipeline("summarization", model="facebook/bart-large-cnn", device=device_id)
+
+def _load_t5_summarizer():
+    device_id = 0 if torch.cuda.is_available() else -1
+    return hf_pipeline("summarization", model="t5-small", device=device_id)
+
+register_model("bart-large-cnn-summarizer", _load_bart_summarizer)
+register_model("t5-small-summarizer", _load_t5_summarizer)
 
 def chunk_text(text, chunk_size=1024):
     """Split text into chunks of ~chunk_size characters (rough approximation of token size)."""
     return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
 
-def summarize_text_local(text_to_summarize, target_words=150):
-    """Summarizes long text using BART with chunking, returns summary as a paragraph."""
+def summarize_text_local(text_to_summarize, target_words=150, raise_errors=False):
+    """Summarizes long text using BART with chunking, returns summary as a paragraph.
+
+    With `raise_errors`, a failed model call or chunk raises instead of returning a fallback
+    or partial summary (so callers don't cache them).
+    """
     if not text_to_summarize or not text_to_summarize.strip():
         print("No text provided for summarization.")
         return "No text to summarize."
 
     print("\n--- Summarization ---")
-    print("Loading summarization model (facebook/bart-large-cnn)...")
+    print("Getting summarization model (facebook/bart-large-cnn)...")
 
     try:
-        device_id = 0 if torch.cuda.is_available() else -1
-        summarizer_pipeline = hf_pipeline("summarization", model="facebook/bart-large-cnn", device=device_id)
+        summarizer_pipeline = get_model("bart-large-cnn-summarizer")
 
         output_min_length = max(30, int(target_words * 0.5))
         output_max_length = int(target_words * 1.5)
@@ -26,23 +42,23 @@ def summarize_text_local(text_to_summarize, target_words=150):
         print(f"Summarizing text (target words: ~{target_words}, output tokens min: {output_min_length}, max: {output_max_length})...")
 
         text_chunks = chunk_text(text_to_summarize, chunk_size=1024)
+        print(f"  - Summarizing {len(text_chunks)} chunks in batches of up to {DEFAULT_BATCH_SIZE}")
+        results = summarize_batched(
+            summarizer_pipeline,
+            text_chunks,
+            max_length=output_max_length,
+            min_length=output_min_length,
+            do_sample=False,
+            truncation=True
+        )
         summaries = []
-
-        for i, chunk in enumerate(text_chunks):
-            try:
-                print(f"  - Summarizing chunk {i+1}/{len(text_chunks)}")
-                summary_result = summarizer_pipeline(
-                    chunk,
-                    max_length=output_max_length,
-                    min_length=output_min_length,
-                    do_sample=False,
-                    truncation=True
-                )
-                summary_text = summary_result[0]['summary_text']
-                summaries.append(summary_text)
-            except Exception as chunk_error:
-                print(f"    [Warning] Chunk {i+1} failed: {chunk_error}")
+        for i, result in enumerate(results):
+            if result["error"] is not None:
+                print(f"    [Warning] Chunk {i+1} failed: {result['error']}")
+                if raise_errors:
+                    raise RuntimeError(f"Summarizing chunk {i+1} failed: {result['error']}")
                 continue
+            summaries.append(result["summary_text"])
 
         final_summary = ' '.join(summaries)
         word_count = len(word_tokenize(final_summary))
@@ -54,9 +70,13 @@ def summarize_text_local(text_to_summarize, target_words=150):
 
     except ImportError:
         print("PyTorch not found. Summarization requires PyTorch.")
+        if raise_errors:
+            raise
         return "Summarization failed: PyTorch not available."
     except Exception as e:
         print(f"Error during summarization: {e}")
+        if raise_errors:
+            raise
         return "Summarization failed."
 
 
@@ -0,0 +1,217 @@
+import asyncio
+import httpx
+import pytest
+
+import backend_client
+import backend_pool
+from backend_pool import BackendPool, CircuitBreaker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freezes the breakers' clock. Not for tests that sleep on the event loop, whose timers share it."""
+    fake = FakeClock()
+    monkeypatch.setattr(backend_pool.time, "monotonic", fake)
+    return fake
+
+@pytest.fixture
+def mock_backends(monkeypatch):
+    """Routes the shared HTTP client to a handler; returns a dict host -> status code (or exception)."""
+    behaviour = {}
+
+    def handler(request):
+        outcome = behaviour.get(request.url.host, 200)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={"host": request.url.host})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(backend_client, "_shared_client", client)
+    return behaviour
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allows_request()
+
+def test_allows_request_has_no_side_effects(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    open_breaker(breaker)
+    clock.now += 10.0
+    assert breaker.allows_request()
+    assert breaker.allows_request()
+    assert breaker.state == "open"
+
+def test_trial_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    open_breaker(breaker)
+    clock.now += 10.0
+    breaker.start_request()
+    assert breaker.state == "half_open"
+    # Only one trial at a time
+    assert not breaker.allows_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.consecutive_failures == 0
+
+def test_trial_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    open_breaker(breaker)
+    clock.now += 10.0
+    breaker.start_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock.now
+    assert not breaker.allows_request()
+
+def test_trial_times_out(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, trial_timeout=30.0)
+    open_breaker(breaker)
+    clock.now += 10.0
+    breaker.start_request()
+    clock.now += 29.0
+    assert not breaker.allows_request()
+    clock.now += 1.0
+    assert breaker.allows_request()
+    breaker.start_request()
+    assert breaker.trial_started_at == clock.now
+
+def test_cancelled_trial_is_released(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    open_breaker(breaker)
+    clock.now += 10.0
+    breaker.start_request()
+    breaker.record_cancelled()
+    assert breaker.state == "open"
+    assert breaker.allows_request()
+
+def test_pick_only_moves_chosen_backend_to_half_open(clock):
+    pool = BackendPool("test", ["http://a", "http://b", "http://c"], failure_threshold=1, reset_timeout=10.0)
+    for backend in pool.backends:
+        open_breaker(backend.breaker)
+    clock.now += 10.0
+    chosen = pool.pick()
+    others = [backend for backend in pool.backends if backend is not chosen]
+    assert chosen.breaker.state == "half_open"
+    assert [backend.breaker.state for backend in others] == ["open", "open"]
+    # The others are still eligible for their own trials.
+    second = pool.pick(exclude=[chosen])
+    assert second in others
+    assert second.breaker.state == "half_open"
+
+def test_pick_returns_none_while_trial_in_flight(clock):
+    pool = BackendPool("test", ["http://a"], failure_threshold=1, reset_timeout=10.0)
+    open_breaker(pool.backends[0].breaker)
+    assert pool.pick() is None
+    clock.now += 10.0
+    assert pool.pick() is pool.backends[0]
+    assert pool.pick() is None
+
+def test_failed_trial_request_reopens(mock_backends):
+    pool = BackendPool("test", ["http://a"], failure_threshold=1, reset_timeout=0.0)
+    open_breaker(pool.backends[0].breaker)
+    mock_backends["a"] = 500
+    response = asyncio.run(pool.post("/run/"))
+    assert response.status_code == 500
+    assert pool.backends[0].breaker.state == "open"
+
+def test_health_check_closes_breaker(mock_backends):
+    pool = BackendPool("test", ["http://a", "http://b"], failure_threshold=1, reset_timeout=10.0)
+    for backend in pool.backends:
+        open_breaker(backend.breaker)
+    mock_backends["b"] = 503
+    asyncio.run(pool.check_health())
+    a, b = pool.backends
+    assert a.healthy and a.breaker.state == "closed"
+    assert not b.healthy and b.breaker.state == "open"
+
+def test_cancelled_hedge_releases_trial(monkeypatch):
+    # Real clock here: the event loop's timers use time.monotonic too.
+    pool = BackendPool("test", ["http://a", "http://b"], failure_threshold=1, reset_timeout=0.0,
+                       hedge_delay=0.01)
+    a, b = pool.backends
+    open_breaker(b.breaker)
+
+    async def slow_handler(request):
+        if request.url.host == "a":
+            await asyncio.sleep(0.05)
+            return httpx.Response(200)
+        await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    async def run():
+        monkeypatch.setattr(backend_client, "_shared_client",
+                            httpx.AsyncClient(transport=httpx.MockTransport(slow_handler)))
+        # Make a the primary so b only runs as the hedge.
+        pick = pool.pick
+        monkeypatch.setattr(pool, "pick", lambda exclude=(): pick(exclude=list(exclude) or [b]))
+        response = await pool.post("/run/")
+        await asyncio.sleep(0)
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    # b was picked as the hedge (its trial started) and then cancelled; it must not stay half-open.
+    assert b.breaker.state == "open"
+    assert b.breaker.allows_request()
+
+def test_failover_on_connect_error(mock_backends):
+    pool = BackendPool("test", ["http://a", "http://b"], retries=0)
+    mock_backends["a"] = httpx.ConnectError("refused")
+    mock_backends["b"] = httpx.ConnectError("refused")
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(pool.post("/run/", hedge=False))
+    mock_backends["b"] = 200
+    for _ in range(5):
+        assert asyncio.run(pool.post("/run/", hedge=False)).json() == {"host": "b"}
+
+def test_no_failover_on_remote_protocol_error(mock_backends):
+    pool = BackendPool("test", ["http://a", "http://b"])
+    mock_backends["a"] = httpx.RemoteProtocolError("connection dropped")
+    mock_backends["b"] = httpx.RemoteProtocolError("connection dropped")
+    with pytest.raises(httpx.RemoteProtocolError):
+        asyncio.run(pool.post("/run/", hedge=False))
+    assert sum(backend.breaker.consecutive_failures for backend in pool.backends) == 1
+
+def test_single_replica_retries_connect_error(monkeypatch):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.host)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("refused")
+        return httpx.Response(200)
+
+    monkeypatch.setattr(backend_client, "_shared_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    pool = BackendPool("test", ["http://a"], retries=2, backoff=0.0)
+    assert asyncio.run(pool.post("/run/")).status_code == 200
+    assert attempts == ["a", "a", "a"]
+
+def test_failover_only_on_retryable_status(mock_backends):
+    pool = BackendPool("test", ["http://a", "http://b"], retries=0)
+    mock_backends["a"] = 503
+    mock_backends["b"] = 503
+    response = asyncio.run(pool.post("/run/", hedge=False))
+    assert response.status_code == 503
+    assert sum(backend.breaker.consecutive_failures for backend in pool.backends) == 2
+
+    # A plain 500 may come from a request the backend already acted on: it is not replayed.
+    pool = BackendPool("test", ["http://a", "http://b"], retries=0)
+    mock_backends["a"] = 500
+    mock_backends["b"] = 500
+    assert asyncio.run(pool.post("/run/", hedge=False)).status_code == 500
+    assert sum(backend.breaker.consecutive_failures for backend in pool.backends) == 1
@@ -0,0 +1,22 @@
+import time
+
+from stage_executor import Stage, run_stages
+
+def sleeper(seconds):
+    def run(inputs):
+        time.sleep(seconds)
+        return seconds
+    return run
+
+def test_time_spent_queued_does_not_count_against_the_timeout():
+    stages = [Stage(f"slow{i}", sleeper(0.3)) for i in range(2)] + [Stage("queued", sleeper(0.1))]
+    outcomes = run_stages(stages, max_workers=2, default_timeout=0.35)
+    assert {name: outcome["status"] for name, outcome in outcomes.items()} == {
+        "slow0": "ok", "slow1": "ok", "queued": "ok"}
+    assert outcomes["queued"]["seconds"] < 0.3
+
+def test_stage_running_past_its_timeout_is_reported():
+    stages = [Stage("hung", sleeper(1.0), timeout=0.1), Stage("after", sleeper(0.0), depends_on=["hung"])]
+    outcomes = run_stages(stages, max_workers=2)
+    assert outcomes["hung"]["status"] == "timeout"
+    assert outcomes["after"]["status"] == "skipped"
@@ -0,0 +1,75 @@
+import random
+import pytest
+from nltk.tokenize import NLTKWordTokenizer
+
+import topic_modeling
+from topic_modeling import CappedDictionary, iter_words
+
+def previous_words(sentence):
+    # The tokenization topic modeling used before: word_tokenize on one sentence, alphabetic tokens only
+    return [word for word in NLTKWordTokenizer().tokenize(sentence.lower()) if word.isalpha()]
+
+def sentences(text):
+    current, result = [], []
+    for word in iter_words(text):
+        if word is None:
+            result.append(current)
+            current = []
+        else:
+            current.append(word)
+    return result + [current] if current else result
+
+@pytest.mark.parametrize("sentence", [
+    "I don't think we can't or won't, but they're sure it's fine.",
+    "The dogs' owner was well-known, and/or famous at 10:30 o'clock.",
+    "She said \"hello\" (quietly) to the naïve café owner; rock'n'roll!",
+    "Prices rose 3.5% in the U.S. and e.g. the U.K. over 1,000 days.",
+    "A--b -dash dash- e-mail #tag @user c++ a=b 'quoted' covid19 foo_bar.",
+])
+def test_words_match_previous_tokenizer(sentence):
+    assert [word for word in iter_words(sentence) if word] == previous_words(sentence)
+
+def test_words_match_previous_tokenizer_on_random_sentences():
+    pieces = ["don't", "can't", "it's", "dogs'", "o'clock", "well-known", "and/or", "e.g.", "3.5", "covid19",
+              "foo_bar", "naïve", "topic", "'quoted'", "a--b", "(left)", "[x]", "c++", "a=b", "smith's", "50%",
+              "$5", "#tag", "@user", "x,y", "1,000", "10:30", "a:b", "...", "-a", "b-", "I'm", "we'll",
+              "they've", "he'd", "rock'n'roll", "e-mail", "«bon»", "x;y", "q&a", "<tag>", "{b}", "‘hi’"]
+    rng = random.Random(0)
+    for _ in range(2000):
+        sentence = " ".join(rng.choice(pieces) for _ in range(rng.randint(1, 8))) + rng.choice([".", "!", "?", ""])
+        assert [word for word in iter_words(sentence) if word] == previous_words(sentence), sentence
+
+def test_sentences_end_only_before_whitespace_or_end():
+    text = 'It costs 3.5 dollars in the U.S. today. Really?! "Yes." Version 2.0 ships... soon'
+    assert sentences(text) == [["it", "costs", "dollars", "in", "the", "today"], ["really"], ["yes"],
+                               ["version", "ships"], ["soon"]]
+
+def test_documents_match_previous_preprocessing():
+    nltk = pytest.importorskip("nltk")
+    for resource in ("tokenizers/punkt_tab", "corpora/stopwords", "corpora/wordnet"):
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            pytest.skip(f"NLTK data '{resource}' is not installed")
+    from nltk.tokenize import sent_tokenize, word_tokenize
+
+    text = ("Welcome back to the show. Today we're talking about machine learning models, "
+            "and why well-trained networks don't generalize. Researchers in Boston found that "
+            "transformers learn faster! What about recurrent networks? They're slower to train.")
+    stop_words = set(nltk.corpus.stopwords.words("english")).union(topic_modeling.STOPWORDS)
+    lemmatizer = nltk.stem.WordNetLemmatizer()
+    expected = []
+    for sentence in sent_tokenize(text):
+        words = [w for w in word_tokenize(sentence.lower()) if w.isalpha() and w not in stop_words and len(w) > 2]
+        if words:
+            expected.append([lemmatizer.lemmatize(w) for w in words])
+    assert topic_modeling.preprocess_and_split_for_topic_modeling(text) == expected
+
+def test_capped_dictionary_ignores_words_past_the_cap():
+    dictionary = CappedDictionary(3)
+    assert dictionary.doc2bow(["cat", "dog", "cat"], allow_update=True) == [(0, 2), (1, 1)]
+    assert dictionary.doc2bow(["cat", "fish", "bird", "bird"], allow_update=True) == [(0, 1), (2, 1)]
+    assert dictionary.token2id == {"cat": 0, "dog": 1, "fish": 2}
+    # Every reserved id reads as a word, so the model's topic-word matrix is sized once
+    assert len(dictionary) == 3 and [dictionary[i] for i in dictionary.keys()] == ["cat", "dog", "fish"]
+    assert CappedDictionary(2)[1] == ""
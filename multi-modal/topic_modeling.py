@@ -1,64 +1,247 @@
+import os
 import re
+import time
+import atexit
+import threading
+from functools import lru_cache
+import numpy as np
 from gensim import corpora
-from gensim.models import LdaModel
+from gensim.models import LdaModel, LdaMulticore
 from gensim.parsing.preprocessing import STOPWORDS # Gensim's own stopwords
-from nltk.tokenize import word_tokenize, sent_tokenize
 from nltk.corpus import stopwords as nltk_stopwords # NLTK's stopwords
 from nltk.stem import WordNetLemmatizer
 
+# One pass over the lowercased transcript, matching sentence ends and words. Each sentence is an
+# LDA "document"; it ends at .!? followed (after any closing quotes/brackets) by whitespace or the
+# end of the text, so "3.5" and "u.s." don't split. Words keep the characters word_tokenize keeps
+# inside a token (hyphens, slashes, apostrophes, inner periods), so the alphabetic words that
+# survive match the word_tokenize + isalpha filtering this replaced.
+_TOKEN_PATTERN = re.compile(
+    r"(?P<end>[.!?]+)(?=[\"')\]’”]*(?:\s|$))"
+    r"|(?P<word>(?:'|(?<!-)-(?!-))*\w(?:[\w'/+=*~^|\\]|-(?!-)|\.(?=\w))*(?:(?<=\.[^\W\d_])\.)?)"
+)
+# Contraction suffixes word_tokenize splits off ("don't" -> "do" + "n't", "dog's" -> "dog" + "'s")
+_CONTRACTION = re.compile(r"(.+?)(?:n't|'s|'re|'ve|'ll|'d|'m)$")
+LEMMA_CACHE_SIZE = 65536
+
+# LDA engine: "single" (LdaModel), "multicore" (LdaMulticore with TOPIC_MODEL_WORKERS processes)
+# or "online" (one persisted global model, updated with each transcript instead of retrained).
+TOPIC_MODEL_ENGINE = os.environ.get("TOPIC_MODEL_ENGINE", "single")
+TOPIC_MODEL_WORKERS = int(os.environ.get("TOPIC_MODEL_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Training stops once a pass changes perplexity by less than this fraction (or after MAX_PASSES).
+# The multicore engine always runs MAX_PASSES in one call, so its worker pool is started once.
+TOPIC_MODEL_MAX_PASSES = int(os.environ.get("TOPIC_MODEL_MAX_PASSES", 20))
+TOPIC_MODEL_PERPLEXITY_TOL = float(os.environ.get("TOPIC_MODEL_PERPLEXITY_TOL", 0.01))
+TOPIC_MODEL_DIR = os.environ.get("TOPIC_MODEL_DIR", "topic_models")
+GLOBAL_NUM_TOPICS = int(os.environ.get("TOPIC_MODEL_GLOBAL_TOPICS", 50))
+# The online model's vocabulary is fixed at creation: words are added until it holds this many, later new words are ignored
+GLOBAL_VOCAB_SIZE = int(os.environ.get("TOPIC_MODEL_GLOBAL_VOCAB", 2 ** 16))
+GLOBAL_SAVE_EVERY = int(os.environ.get("TOPIC_MODEL_SAVE_EVERY", 10))  # Updates between saves
+
 # Module-level cache for NLP objects to avoid re-initialization
 _stop_words_set_tm = None
 _wordnet_lemmatizer_tm = None
 
-def preprocess_text_for_topic_modeling(text_for_lda):
-    """Preprocesses a single string of text for LDA."""
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _normalize_token(word):
+    """Returns the lemma for a lowercased word, or None when it is filtered out.
+
+    Memoized: transcripts reuse the same vocabulary, so most calls are cache hits.
+    """
     global _stop_words_set_tm, _wordnet_lemmatizer_tm
-    
+
     if _stop_words_set_tm is None:
         # Combine NLTK and Gensim stopwords for a more comprehensive set
         _stop_words_set_tm = set(nltk_stopwords.words('english')).union(STOPWORDS)
     if _wordnet_lemmatizer_tm is None:
         _wordnet_lemmatizer_tm = WordNetLemmatizer()
 
-    tokens = word_tokenize(text_for_lda.lower())
-    tokens = [
-        word for word in tokens 
-        if word.isalpha() and word not in _stop_words_set_tm and len(word) > 2 # Basic filtering
-    ]
-    tokens = [_wordnet_lemmatizer_tm.lemmatize(word) for word in tokens]
-    return tokens
+    if len(word) <= 2 or word in _stop_words_set_tm: # Basic filtering
+        return None
+    return _wordnet_lemmatizer_tm.lemmatize(word)
+
+def iter_words(text):
+    """Yields the lowercased alphabetic words of `text`, and None at the end of each sentence."""
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        if match.group("end"):
+            yield None
+            continue
+        word = match.group("word").strip("'")  # Quotes around a word are separate tokens
+        contraction = _CONTRACTION.match(word)
+        if contraction:
+            word = contraction.group(1)
+        if word.isalpha():
+            yield word
+
+def iter_topic_modeling_documents(transcription_text):
+    """Lazily yields one list of lemmas per sentence, skipping sentences left empty by filtering."""
+    doc_tokens = []
+    for word in iter_words(transcription_text):
+        if word is None:
+            if doc_tokens:
+                yield doc_tokens
+                doc_tokens = []
+            continue
+        lemma = _normalize_token(word)
+        if lemma is not None:
+            doc_tokens.append(lemma)
+    if doc_tokens:
+        yield doc_tokens
+
+def preprocess_text_for_topic_modeling(text_for_lda):
+    """Preprocesses a single string of text for LDA."""
+    return [lemma for doc_tokens in iter_topic_modeling_documents(text_for_lda) for lemma in doc_tokens]
 
 def preprocess_and_split_for_topic_modeling(transcription_text):
     """Splits transcription into sentences and preprocesses each for topic modeling."""
     if not transcription_text or not transcription_text.strip():
         return []
-    
-    # Use NLTK's sent_tokenize for more robust sentence splitting
-    sentences = sent_tokenize(transcription_text)
-    processed_docs = [preprocess_text_for_topic_modeling(sentence) for sentence in sentences]
-    # Filter out any empty lists of tokens that might result from very short sentences
-    # or sentences consisting only of stopwords/short words.
-    processed_docs = [doc_tokens for doc_tokens in processed_docs if doc_tokens]
-    return processed_docs
-
-def perform_topic_modeling_local(transcription_text, num_topics=5, num_words_per_topic=5):
-    """Builds an LDA model and prints topics."""
+    return list(iter_topic_modeling_documents(transcription_text))
+
+def _collect(documents, into):
+    # Passes documents through to a consumer (corpora.Dictionary) while keeping them for doc2bow.
+    for doc_tokens in documents:
+        into.append(doc_tokens)
+        yield doc_tokens
+
+def train_until_converged(lda_model, corpus, max_passes=TOPIC_MODEL_MAX_PASSES, tol=TOPIC_MODEL_PERPLEXITY_TOL):
+    """Runs one pass at a time until perplexity changes by less than `tol` (relative). Returns passes run.
+
+    `lda_model` must be built with passes=1 and without a corpus, so each update() is a single pass.
+    """
+    previous = None
+    for passes in range(1, max_passes + 1):
+        lda_model.update(corpus)
+        perplexity = 2 ** (-lda_model.log_perplexity(corpus))
+        if previous is not None and abs(previous - perplexity) / previous < tol:
+            break
+        previous = perplexity
+    return passes
+
+class CappedDictionary(corpora.Dictionary):
+    """A Dictionary with a fixed id range of `max_size`, for models that keep learning new words.
+
+    Like HashDictionary it reports all `max_size` ids, so an LdaModel built on it sizes its
+    topic-word matrix once; but ids map to single words: new words get the next free id until the
+    range is full and are ignored after that. Ids not given to a word yet read as "".
+    """
+
+    def __init__(self, max_size, documents=None):
+        self.max_size = max_size
+        super().__init__(documents)
+
+    def __len__(self):
+        return self.max_size
+
+    def keys(self):
+        return list(range(self.max_size))
+
+    def __getitem__(self, tokenid):
+        if tokenid >= len(self.token2id) and tokenid < self.max_size:
+            return ""
+        return super().__getitem__(tokenid)
+
+    def doc2bow(self, document, allow_update=False, return_missing=False):
+        if allow_update:
+            room = self.max_size - len(self.token2id)
+            new_words = [word for word in dict.fromkeys(document) if word not in self.token2id]
+            if len(new_words) > room:
+                ignored = set(new_words[room:])
+                document = [word for word in document if word not in ignored]
+        return super().doc2bow(document, allow_update=allow_update, return_missing=return_missing)
+
+def _topic_words(lda_model, dictionary, topic_id, num_words):
+    # Ranks only the ids already given to a word
+    weights = lda_model.state.get_lambda()[topic_id, :len(dictionary.token2id)]
+    return [dictionary[word_id] for word_id in np.argsort(weights)[::-1][:num_words]]
+
+# Global model for the "online" engine, loaded on first use
+_global_lda = None
+_global_dictionary = None
+_global_updates = 0
+_global_lock = threading.Lock()
+
+def _load_global_model():
+    global _global_lda, _global_dictionary
+    if _global_lda is not None:
+        return
+    model_path = os.path.join(TOPIC_MODEL_DIR, "global_lda.model")
+    dictionary_path = os.path.join(TOPIC_MODEL_DIR, "global_lda.dict")
+    if os.path.exists(model_path) and os.path.exists(dictionary_path):
+        print(f"Loading global topic model from {TOPIC_MODEL_DIR}...")
+        _global_dictionary = CappedDictionary.load(dictionary_path)
+        _global_lda = LdaModel.load(model_path)
+        _global_lda.id2word = _global_dictionary
+    else:
+        print("Creating a new global topic model...")
+        _global_dictionary = CappedDictionary(GLOBAL_VOCAB_SIZE)
+        # eta stays symmetric: re-estimating it touches every topic-word weight on each update
+        _global_lda = LdaModel(num_topics=GLOBAL_NUM_TOPICS, id2word=_global_dictionary, alpha='auto', eta='symmetric',
+                               eval_every=None, random_state=42)
+    atexit.register(save_global_model)
+
+def save_global_model():
+    with _global_lock:
+        if _global_lda is None:
+            return
+        os.makedirs(TOPIC_MODEL_DIR, exist_ok=True)
+        _global_dictionary.save(os.path.join(TOPIC_MODEL_DIR, "global_lda.dict"))
+        _global_lda.save(os.path.join(TOPIC_MODEL_DIR, "global_lda.model"))
+
+def _online_topics(processed_text_data_for_lda, num_topics, num_words_per_topic):
+    """Updates the global model with this transcript and returns its most prominent global topics."""
+    global _global_updates
+    with _global_lock:
+        _load_global_model()
+        corpus = [_global_dictionary.doc2bow(text_tokens, allow_update=True) for text_tokens in processed_text_data_for_lda]
+        _global_lda.update(corpus)
+        _global_updates += 1
+        # The whole transcript as one bag of words, to rank the topics it covers
+        episode_bow = _global_dictionary.doc2bow([lemma for text_tokens in processed_text_data_for_lda for lemma in text_tokens])
+        episode_topics = sorted(_global_lda.get_document_topics(episode_bow, minimum_probability=0.0),
+                                key=lambda topic: -topic[1])[:num_topics]
+        extracted_topics = [
+            {"topic_id": topic_id, "words": _topic_words(_global_lda, _global_dictionary, topic_id, num_words_per_topic)}
+            for topic_id, _ in episode_topics
+        ]
+        should_save = _global_updates % GLOBAL_SAVE_EVERY == 0
+    if should_save:
+        save_global_model()
+    return extracted_topics
+
+def perform_topic_modeling_local(transcription_text, num_topics=5, num_words_per_topic=5, engine=None, raise_errors=False):
+    """Builds an LDA model, prints topics and returns them as [{"topic_id", "words"}].
+
+    `engine` overrides TOPIC_MODEL_ENGINE ("single", "multicore" or "online").
+    With `raise_errors`, unexpected failures are raised instead of returning [].
+    """
     if not transcription_text or not transcription_text.strip():
         print("No text provided for topic modeling.")
-        return
+        return []
+    engine = engine or TOPIC_MODEL_ENGINE
+    if engine not in ("single", "multicore", "online"):
+        raise ValueError(f"Unknown topic model engine: {engine}")
 
     print("\n--- Topic Modeling ---")
     print("Preprocessing text for topic modeling...")
-    # Each "document" for LDA will be a preprocessed sentence
-    processed_text_data_for_lda = preprocess_and_split_for_topic_modeling(transcription_text)
+    try:
+        # Each "document" for LDA is a preprocessed sentence, streamed into the dictionary as it is produced
+        processed_text_data_for_lda = []
+        dictionary = corpora.Dictionary(_collect(iter_topic_modeling_documents(transcription_text), processed_text_data_for_lda))
 
-    if not processed_text_data_for_lda: # Check if list of lists of tokens is empty
-        print("The corpus is empty after preprocessing all sentences. Cannot perform topic modeling.")
-        return
+        if not processed_text_data_for_lda: # Check if list of lists of tokens is empty
+            print("The corpus is empty after preprocessing all sentences. Cannot perform topic modeling.")
+            return []
 
-    print("Building LDA model...")
-    try:
-        dictionary = corpora.Dictionary(processed_text_data_for_lda)
+        if engine == "online":
+            print("Updating the global LDA model...")
+            extracted_topics = _online_topics(processed_text_data_for_lda, num_topics, num_words_per_topic)
+            print(f"\nMost prominent global topics (Top {num_words_per_topic} words per topic):")
+            for topic in extracted_topics:
+                print(f"  Topic {topic['topic_id']}: {', '.join(topic['words'])}")
+            return extracted_topics
+
+        print(f"Building LDA model ({engine})...")
         # Filter out tokens that appear in less than 2 documents (sentences in this case)
         # or in more than 50% of the documents (too common). Adjust as needed.
         dictionary.filter_extremes(no_below=2, no_above=0.5)
@@ -66,7 +249,7 @@ def perform_topic_modeling_local(transcription_text, num_topics=5, num_words_per
         # If dictionary becomes empty after filtering
         if not dictionary:
             print("Dictionary is empty after filtering extremes. Text might be too short or homogeneous.")
-            return
+            return []
 
         corpus = [dictionary.doc2bow(text_tokens) for text_tokens in processed_text_data_for_lda]
         # Filter out any documents that became empty after dictionary filtering (if tokens were removed)
@@ -76,32 +259,100 @@ def perform_topic_modeling_local(transcription_text, num_topics=5, num_words_per
         if not corpus:
             print("The corpus is empty after creating Bag-of-Words with the filtered dictionary.")
             print("This might happen if the text is too short or too homogeneous for the given filters.")
-            return
+            return []
 
-        # Build LDA model
-        lda_model = LdaModel(
-            corpus=corpus,
-            num_topics=num_topics,
-            id2word=dictionary,
-            passes=20,          # Number of passes through the corpus during training
-            iterations=100,     # Max number of iterations through the corpus
-            alpha='auto',       # Learn alpha from data
-            eta='auto',         # Learn eta from data
-            random_state=42     # For reproducibility
-        )
+        # Build LDA model; the single-process model trains pass by pass until perplexity converges
+        if engine == "multicore":
+            # Every update() starts a new worker pool, so all passes run in one training call
+            lda_model = LdaMulticore(
+                corpus=corpus,
+                num_topics=num_topics,
+                id2word=dictionary,
+                workers=TOPIC_MODEL_WORKERS,
+                passes=TOPIC_MODEL_MAX_PASSES,
+                iterations=100,     # Max number of iterations through the corpus
+                eval_every=None,    # Skip the per-chunk perplexity estimate
+                alpha='symmetric',  # LdaMulticore cannot learn alpha
+                eta='auto',         # Learn eta from data
+                random_state=42     # For reproducibility
+            )
+            passes = TOPIC_MODEL_MAX_PASSES
+        else:
+            lda_model = LdaModel(
+                num_topics=num_topics,
+                id2word=dictionary,
+                iterations=100,     # Max number of iterations through the corpus
+                eval_every=None,    # Perplexity is evaluated by train_until_converged
+                alpha='auto',       # Learn alpha from data
+                eta='auto',         # Learn eta from data
+                random_state=42     # For reproducibility
+            )
+            passes = train_until_converged(lda_model, corpus)
+        print(f"Trained for {passes} pass(es).")
 
         print(f"\nExtracted Topics (Top {num_words_per_topic} words per topic):")
         topics = lda_model.print_topics(num_topics=num_topics, num_words=num_words_per_topic)
+        extracted_topics = []
         if topics:
             for topic_id, topic_words_str in topics:
                 # Parsing the string like '0.015*"word1" + 0.012*"word2"' to get just words
                 topic_words_list = [word.split('*"')[1].replace('"', '') for word in topic_words_str.split(' + ')]
                 print(f"  Topic {topic_id}: {', '.join(topic_words_list)}")
+                extracted_topics.append({"topic_id": topic_id, "words": topic_words_list})
         else:
             print("  No topics could be extracted with the current settings/data.")
+        return extracted_topics
             
     except ValueError as ve:
         print(f"Error during topic modeling (ValueError): {ve}")
         print("This often means the text was too short, or filtering was too aggressive for LDA.")
+        return []
     except Exception as e:
-        print(f"An unexpected error occurred during topic modeling: {e}")
\ No newline at end of file
+        print(f"An unexpected error occurred during topic modeling: {e}")
+        if raise_errors:
+            raise
+        return []
+
+def benchmark_preprocessing(hours=3, words_per_minute=150, repeats=3):
+    """Times preprocessing of a synthetic multi-hour transcript against the previous NLTK pipeline
+    (sent_tokenize + word_tokenize per sentence + uncached lemmatize)."""
+    from nltk.tokenize import word_tokenize, sent_tokenize
+
+    vocabulary = ("the podcast guests talked about running companies building products hiring engineers "
+                  "raising money and the markets they were watching this year while their listeners asked "
+                  "questions about careers models data pipelines and what they would change next time").split()
+    num_words = hours * 60 * words_per_minute
+    words = [vocabulary[(i * 7919) % len(vocabulary)] for i in range(num_words)]
+    transcript = " ".join(word + ("." if i % 17 == 16 else "") for i, word in enumerate(words))
+
+    def legacy(text):
+        stop_words = set(nltk_stopwords.words('english')).union(STOPWORDS)
+        lemmatizer = WordNetLemmatizer()
+        docs = []
+        for sentence in sent_tokenize(text):
+            tokens = [w for w in word_tokenize(sentence.lower()) if w.isalpha() and w not in stop_words and len(w) > 2]
+            tokens = [lemmatizer.lemmatize(w) for w in tokens]
+            if tokens:
+                docs.append(tokens)
+        return docs
+
+    def current(text):
+        _normalize_token.cache_clear()
+        docs = []
+        corpora.Dictionary(_collect(iter_topic_modeling_documents(text), docs))
+        return docs
+
+    print(f"Synthetic transcript: {hours}h, {num_words} words, {len(transcript)} characters")
+    for name, run in (("legacy", legacy), ("current", current)):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            docs = run(transcript)
+            best = min(best, time.perf_counter() - start)
+        print(f"  {name:8s} {best:.3f}s best of {repeats} ({len(docs)} documents)")
+    print(f"  lemma cache: {_normalize_token.cache_info()}")
+
+if __name__ == '__main__':
+    from setup import setup_nltk_resources
+    setup_nltk_resources()
+    benchmark_preprocessing()
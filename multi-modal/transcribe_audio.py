@@ -3,9 +3,22 @@ import os
 # ✅ Add FFmpeg to PATH for this session (required by Whisper)
 os.environ["PATH"] += os.pathsep + r"D:\Downloads\ffmpeg-7.0.2-essentials_build\ffmpeg-7.0.2-essentials_build\bin"
 
+import subprocess
+import numpy as np
 import torch
 import whisper  # OpenAI's Whisper
 from transformers import pipeline as hf_pipeline  # Avoids conflict with other 'pipeline'
+from model_registry import register_model, get_model
+
+def _load_whisper_base():
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return whisper.load_model("base").to(device)
+
+def _load_translator():
+    return hf_pipeline("translation", model="Helsinki-NLP/opus-mt-mul-en", device=0 if torch.cuda.is_available() else -1)
+
+register_model("whisper-base", _load_whisper_base)
+register_model("opus-mt-mul-en", _load_translator)
 
 # ✅ Helper: Convert seconds to mm:ss
 def format_timestamp_mmss(seconds):
@@ -13,6 +26,124 @@ def format_timestamp_mmss(seconds):
     secs = int(seconds % 60)
     return f"{minutes:02d}:{secs:02d}"
 
+def _iter_audio_windows(audio_path, window_seconds):
+    """Decodes audio through an ffmpeg pipe and yields (offset_seconds, samples, is_last) windows.
+
+    After each window the caller sends (generator.send) the offset in seconds where the next
+    window starts; it must be later than the current window's offset. Only the audio from that
+    offset onwards is kept, so memory stays around one window of 16 kHz mono float32 samples.
+    """
+    sample_rate = whisper.audio.SAMPLE_RATE
+    window_samples = int(window_seconds * sample_rate)
+
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", audio_path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-",
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read_samples(count):
+        raw = process.stdout.read(count * 2)
+        return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+    try:
+        buffer = np.zeros(0, np.float32)
+        buffer_offset = 0  # Sample index of buffer[0]
+        at_eof = False
+        while True:
+            # Read one sample past the window so the final window can be flagged as such.
+            missing = window_samples + 1 - len(buffer)
+            if missing > 0 and not at_eof:
+                chunk = read_samples(missing)
+                at_eof = len(chunk) < missing
+                buffer = np.concatenate([buffer, chunk])
+            if not len(buffer):
+                break
+            is_last = at_eof and len(buffer) <= window_samples
+            next_offset = yield buffer_offset / sample_rate, buffer[:window_samples], is_last
+            if is_last:
+                break
+            next_sample = int(round(next_offset * sample_rate))
+            if next_sample <= buffer_offset:
+                raise ValueError("The next window must start after the current one.")
+            skip = next_sample - buffer_offset
+            # Samples between the end of the buffer and the next offset are decoded and dropped.
+            while skip > len(buffer) and not at_eof:
+                chunk = read_samples(min(skip - len(buffer), window_samples))
+                at_eof = len(chunk) == 0
+                buffer = np.concatenate([buffer, chunk])
+            buffer = buffer[skip:]
+            buffer_offset = next_sample
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+def transcribe_audio_streaming(audio_path, window_seconds=30, overlap_seconds=5, language=None):
+    """Transcribes audio window by window, yielding segments as soon as each window is decoded.
+
+    Yields dicts with "start", "end", "text" and "language". A window only commits segments
+    that end before the middle of its trailing overlap (all of them if none does); the next
+    window starts where the last committed segment ended, so no audio is skipped between
+    windows. Segments whose midpoint falls before the last committed end are skipped as
+    already emitted.
+    """
+    if not audio_path or not os.path.exists(audio_path):
+        print(f"Audio file not found or path is invalid: {audio_path}")
+        return
+    if overlap_seconds >= window_seconds:
+        raise ValueError("overlap_seconds must be smaller than window_seconds.")
+
+    model = get_model("whisper-base")
+    fp16 = torch.cuda.is_available()
+    committed_end = 0.0
+    previous_text = ""
+
+    windows = _iter_audio_windows(audio_path, window_seconds)
+    offset, samples, is_last = next(windows, (None, None, None))
+    while offset is not None:
+        result = model.transcribe(
+            samples,
+            language=language,
+            initial_prompt=previous_text[-200:] or None,  # Carry context across window boundaries
+            condition_on_previous_text=False,
+            fp16=fp16,
+            verbose=None,
+        )
+        if language is None:
+            language = result.get("language", "unknown")
+
+        new_segments = []
+        for segment in result.get("segments", []):
+            start = offset + segment["start"]
+            end = offset + segment["end"]
+            text = segment["text"].strip()
+            if text and (start + end) / 2 >= committed_end:
+                new_segments.append({"start": start, "end": end, "text": text, "language": language})
+        commit_limit = float("inf") if is_last else offset + window_seconds - overlap_seconds / 2
+        to_commit = []
+        for segment in new_segments:
+            if segment["end"] > commit_limit:
+                break
+            to_commit.append(segment)
+        # A segment reaching into the overlap that starts the window would otherwise be dropped
+        # and its audio skipped, so commit the whole window instead.
+        for segment in to_commit or new_segments:
+            committed_end = segment["end"]
+            previous_text += " " + segment["text"]
+            yield segment
+
+        if is_last:
+            break
+        # Resume at the last committed end; if nothing new was committed (silence), fall back to
+        # a fixed step so the stream always advances.
+        next_offset = committed_end if committed_end > offset else offset + window_seconds - overlap_seconds
+        try:
+            offset, samples, is_last = windows.send(next_offset)
+        except StopIteration:
+            break
+    windows.close()
+
 def transcribe_and_translate_audio(audio_path):
     """Transcribes audio using Whisper, returns timestamped segments and language."""
     
@@ -20,9 +151,8 @@ def transcribe_and_translate_audio(audio_path):
         print(f"Audio file not found or path is invalid: {audio_path}")
         return None, None, None
 
-    print("Loading Whisper model for transcription...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = whisper.load_model("base").to(device)
+    print("Getting Whisper model for transcription...")
+    model = get_model("whisper-base")
 
     print(f"Transcribing audio file: {audio_path} (this may take a while)...")
     result = model.transcribe(audio_path, verbose=False)
@@ -79,7 +209,7 @@ def transcribe_and_translate_audio(audio_path):
     if detected_language != "en" and full_transcription.strip():
         print("\nTranslating transcription to English...")
         try:
-            translator = hf_pipeline("translation", model="Helsinki-NLP/opus-mt-mul-en", device=0 if torch.cuda.is_available() else -1)
+            translator = get_model("opus-mt-mul-en")
             char_chunk_size = 400
             text_chunks = [full_transcription[i:i+char_chunk_size] for i in range(0, len(full_transcription), char_chunk_size)]
 